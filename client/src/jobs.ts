@@ -0,0 +1,34 @@
+// Client side of the server's background jobs (server/jobs.py): submit once, then
+// poll the job until it finishes, reporting listing progress along the way.
+
+export interface JobStatus<T = unknown> {
+  jobId: string;
+  kind: string;
+  status: 'queued' | 'running' | 'done' | 'error';
+  progress: { pagesListed: number; keysScanned: number };
+  result?: T;
+  error?: string;
+}
+
+const POLL_INTERVAL_MS = 1000;
+
+export const waitForJob = async <T>(
+  statusUrl: string,
+  onProgress?: (job: JobStatus<T>) => void,
+): Promise<T> => {
+  for (;;) {
+    const response = await fetch(statusUrl);
+    const job: JobStatus<T> = await response.json();
+    if (!response.ok || job.status === 'error') {
+      throw new Error(job.error || `HTTP error! status: ${response.status}`);
+    }
+    if (job.status === 'done') {
+      return job.result as T;
+    }
+    onProgress?.(job);
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+  }
+};
+
+export const formatProgress = (job: JobStatus): string =>
+  `${job.progress.pagesListed} page(s) listed, ${job.progress.keysScanned} key(s) scanned`;
@@ -1,4 +1,6 @@
 import React, { useState, useEffect } from 'react';
+import { waitForJob, formatProgress } from '../jobs';
+import type { JobStatus } from '../jobs';
 
 interface LabelSummary {
   todayReport: string;
@@ -10,19 +12,25 @@ const LabelSummaryPage: React.FC = () => {
   const [summary, setSummary] = useState<LabelSummary | null>(null);
   const [loading, setLoading] = useState<boolean>(true);
   const [error, setError] = useState<string | null>(null);
+  const [progress, setProgress] = useState<string | null>(null);
 
   useEffect(() => {
     const fetchLabelSummary = async () => {
       setLoading(true);
       setError(null);
       try {
-        const response = await fetch('/api/label-summary');
+        // Run as background jobs so slow days don't hit proxy timeouts
+        const response = await fetch('/api/label-summary/jobs', { method: 'POST' });
         if (!response.ok) {
           const errorData = await response.json();
           throw new Error(errorData.message || `HTTP error! status: ${response.status}`);
         }
-        const data: LabelSummary = await response.json();
-        setSummary(data);
+        const { todayJob, nextDayJob }: { todayJob: JobStatus; nextDayJob: JobStatus } = await response.json();
+        const [todayReport, nextDayReport] = await Promise.all([
+          waitForJob<string>(`/api/label-summary/jobs/${todayJob.jobId}`, (job) => setProgress(formatProgress(job))),
+          waitForJob<string>(`/api/label-summary/jobs/${nextDayJob.jobId}`),
+        ]);
+        setSummary({ todayReport, nextDayReport });
       } catch (e: any) {
         setError(e.message);
       } finally {
@@ -34,7 +42,7 @@ const LabelSummaryPage: React.FC = () => {
   }, []);
 
   if (loading) {
-    return <div>Loading label summary...</div>;
+    return <div>Loading label summary...{progress && ` (${progress})`}</div>;
   }
 
   if (error) {
@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useCallback } from 'react';
 import './S3DownloaderPage.css'; // Assuming you'll create a CSS file for this
+import { waitForJob, formatProgress } from '../jobs';
 
 interface S3Object {
   name: string;
@@ -99,12 +100,36 @@ const S3DownloaderPage: React.FC = () => {
       alert('Please enter a search term.');
       return;
     }
-    const result = await fetchData(currentPrefix, 'search', searchTerm);
-    if (result && result.image_data) {
+    setLoading(true);
+    setError(null);
+    setStatus('Searching...');
+    let result: { key: string } | null = null;
+    try {
+      // Searches walk the whole prefix, so run them as a background job and poll it
+      const queryParams = new URLSearchParams({ bucket, profile, region, prefix: currentPrefix, term: searchTerm });
+      const response = await fetch(`/api/s3-downloader/search/jobs?${queryParams.toString()}`, { method: 'POST' });
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.message || 'Failed to start search');
+      }
+      result = await waitForJob<{ key: string } | null>(
+        `/api/s3-downloader/search/jobs/${job.jobId}`,
+        (progress) => setStatus(`Searching... ${formatProgress(progress)}`),
+      );
+    } catch (err) {
+      console.error('Search failed:', err);
+      setError(err instanceof Error ? err.message : String(err));
+      setStatus('Error');
+      return;
+    } finally {
+      setLoading(false);
+    }
+    if (result && result.key) {
       await loadImage(result.key);
     } else {
       alert('No matching PNG found.');
       setSelectedImage(null);
+      setStatus('Ready');
     }
   };
 
@@ -118,6 +143,7 @@ const S3DownloaderPage: React.FC = () => {
         key,
         profile,
         region,
+        encoding: 'auto', // 1-bit PNG for monochrome labels, lossless WebP otherwise
       });
       const response = await fetch(`/api/s3-downloader/image?${queryParams.toString()}`);
       const data = await response.json();
@@ -141,13 +167,26 @@ const S3DownloaderPage: React.FC = () => {
     if (selectedImage) {
       const link = document.createElement('a');
       link.href = selectedImage.data;
-      link.download = selectedImage.key.split('/').pop() || 'download.png';
+      const fileName = selectedImage.key.split('/').pop() || 'download.png';
+      link.download = selectedImage.data.startsWith('data:image/webp') ? fileName.replace(/\.png$/i, '') + '.webp' : fileName;
       document.body.appendChild(link);
       link.click();
       document.body.removeChild(link);
     }
   };
 
+  const exportZip = () => {
+    // Streamed by the server, so let the browser handle it as a normal download
+    const queryParams = new URLSearchParams({
+      bucket,
+      prefix: currentPrefix,
+      term: searchTerm,
+      profile,
+      region,
+    });
+    window.location.href = `/api/s3-downloader/export?${queryParams.toString()}`;
+  };
+
   useEffect(() => {
     // Initial connection attempt
     connectS3();
@@ -188,6 +227,7 @@ const S3DownloaderPage: React.FC = () => {
           onChange={(e) => setSearchTerm(e.target.value)}
         />
         <button onClick={handleSearch} disabled={loading}>Search</button>
+        <button onClick={exportZip} disabled={loading}>Export ZIP</button>
       </div>
 
       <p className="status-message">Status: {status}</p>
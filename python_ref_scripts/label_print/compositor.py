@@ -0,0 +1,249 @@
+import argparse
+import io
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import boto3
+from PIL import Image
+
+# Label decoding, key listing and the throttle-aware S3 controller are shared with the server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server"))
+from decoding import decode_label_bytes
+from s3_controller import CONTROLLER
+from s3_downloader_api import iter_png_keys
+
+DEFAULT_BUCKET = "pat-labels"
+DEFAULT_PROFILE = "gateway"
+
+# Sheet sizes in inches; "label" prints one label per page at label size
+SHEET_SIZES = {
+    "a4": (8.27, 11.69),
+    "letter": (8.5, 11.0),
+}
+
+
+def human_error(e: Exception) -> str:
+    return f"{type(e).__name__}: {str(e) or 'No details'}"
+
+
+def parse_size(text: str):
+    """Parses '4x6' (inches) into a (width, height) tuple."""
+    w, h = text.lower().rstrip("in").split("x")
+    return float(w), float(h)
+
+
+def build_layout(dpi: int, label_size, sheet: str, margin: float, gap: float) -> dict:
+    """
+    Works out the page size and label slot positions, all in pixels.
+    """
+    label_w, label_h = (round(v * dpi) for v in label_size)
+    if sheet == "label":
+        return {"page": (label_w, label_h), "slot": (label_w, label_h), "origins": [(0, 0)]}
+
+    page_w, page_h = (round(v * dpi) for v in SHEET_SIZES[sheet])
+    margin_px, gap_px = round(margin * dpi), round(gap * dpi)
+
+    def fit(page, label):
+        return max(0, (page - 2 * margin_px + gap_px) // (label + gap_px))
+
+    cols, rows = fit(page_w, label_w), fit(page_h, label_h)
+    # Turn the grid sideways if that fits more labels on the sheet
+    if fit(page_w, label_h) * fit(page_h, label_w) > cols * rows:
+        label_w, label_h = label_h, label_w
+        cols, rows = fit(page_w, label_w), fit(page_h, label_h)
+    if not cols or not rows:
+        raise ValueError(f"A {label_size[0]}x{label_size[1]}in label does not fit on a {sheet} sheet")
+
+    origins = [
+        (margin_px + c * (label_w + gap_px), margin_px + r * (label_h + gap_px))
+        for r in range(rows) for c in range(cols)
+    ]
+    return {"page": (page_w, page_h), "slot": (label_w, label_h), "origins": origins}
+
+
+def render_label(png_bytes: bytes, slot):
+    """
+    Decodes a label and fits it to the slot: rotated to match the slot's
+    orientation, then scaled to fit while keeping its aspect ratio.
+    """
+    image = Image.open(io.BytesIO(png_bytes))
+    if image.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white so it doesn't print as black
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, "white")
+        image = Image.alpha_composite(background, image)
+    image = image.convert("L")
+
+    slot_w, slot_h = slot
+    if (image.width > image.height) != (slot_w > slot_h) and image.width != image.height:
+        image = image.transpose(Image.ROTATE_90)
+    scale = min(slot_w / image.width, slot_h / image.height)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+    return image
+
+
+def compose_sheet(labels, layout):
+    """
+    Process-pool worker: decodes the (key, raw_bytes) pairs for one sheet and
+    returns (1-bit sheet image, failures).
+    """
+    sheet = Image.new("L", layout["page"], 255)
+    slot_w, slot_h = layout["slot"]
+    failures = []
+    slots = iter(layout["origins"])
+    for key, raw in labels:
+        try:
+            label = render_label(decode_label_bytes(raw), layout["slot"])
+        except Exception as e:
+            failures.append((key, human_error(e)))
+            continue
+        x, y = next(slots)
+        # Centre the label within its slot
+        sheet.paste(label, (x + (slot_w - label.width) // 2, y + (slot_h - label.height) // 2))
+    return sheet.convert("1", dither=Image.NONE), failures
+
+
+def encode_png(sheet) -> bytes:
+    buffered = io.BytesIO()
+    sheet.save(buffered, format="PNG", optimize=True)
+    return buffered.getvalue()
+
+
+def compose_png_sheet(labels, layout):
+    """Like compose_sheet, but also PNG-encodes the sheet inside the worker."""
+    sheet, failures = compose_sheet(labels, layout)
+    return encode_png(sheet), failures
+
+
+class SheetWriter:
+    """
+    Writes sheets as they are finished as one PNG per sheet in a directory,
+    or collects them in order for a single PDF written by close(). Pillow
+    re-serializes the whole file on every append=True save, so appending page
+    by page grows quadratically; the 1-bit sheets are small enough to hold.
+    """
+
+    def __init__(self, out: str, dpi: int):
+        self.out = out
+        self.dpi = dpi
+        self.pdf = out.lower().endswith(".pdf")
+        self.count = 0
+        self.pages = []
+        if not self.pdf:
+            os.makedirs(out, exist_ok=True)
+
+    def write(self, sheet):
+        self.count += 1
+        if self.pdf:
+            self.pages.append(sheet)
+        else:
+            path = os.path.join(self.out, f"sheet_{self.count:04d}.png")
+            with open(path, "wb") as f:
+                f.write(sheet)
+
+    def close(self):
+        if self.pages:
+            self.pages[0].save(self.out, format="PDF", resolution=self.dpi, save_all=True,
+                               append_images=self.pages[1:])
+            self.pages = []
+
+
+def compose_print_run(s3, bucket: str, prefix: str, out: str, layout: dict, dpi: int,
+                      term: str = None, workers: int = None, fetch_workers: int = 16):
+    """
+    Streams labels through download threads and a process pool of sheet
+    compositors, writing each sheet as soon as it (and all earlier ones) are done.
+    s3 should come from CONTROLLER.client(), so downloads back off under
+    throttling. Returns (sheets_written, labels_placed, failures).
+    """
+    per_sheet = len(layout["origins"])
+    workers = workers or os.cpu_count() or 1
+    writer = SheetWriter(out, dpi)
+    worker_fn = compose_sheet if writer.pdf else compose_png_sheet
+    failures = []
+    placed = 0
+    # Enough sheets in flight to keep every download thread busy
+    fetch_ahead = max(2, fetch_workers // per_sheet + 1)
+
+    def fetch(key):
+        try:
+            return key, s3.get_object(Bucket=bucket, Key=key)["Body"].read(), None
+        except Exception as e:
+            return key, None, human_error(e)
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as io_pool, ProcessPoolExecutor(max_workers=workers) as cpu_pool:
+        fetching = deque()
+        composing = deque()
+
+        def finish_one():
+            nonlocal placed
+            future, submitted = composing.popleft()
+            sheet, sheet_failures = future.result()
+            if len(sheet_failures) < submitted:
+                writer.write(sheet)
+            placed += submitted - len(sheet_failures)
+            failures.extend(sheet_failures)
+
+        def submit_one():
+            labels = []
+            for future in fetching.popleft():
+                key, raw, error = future.result()
+                if error:
+                    failures.append((key, error))
+                else:
+                    labels.append((key, raw))
+            if labels:
+                composing.append((cpu_pool.submit(worker_fn, labels, layout), len(labels)))
+            # Keep at most a couple of sheets per worker in memory
+            while len(composing) > workers * 2:
+                finish_one()
+
+        batch = []
+        for key in iter_png_keys(s3, bucket, prefix, term):
+            batch.append(key)
+            if len(batch) == per_sheet:
+                fetching.append([io_pool.submit(fetch, k) for k in batch])
+                batch = []
+                if len(fetching) > fetch_ahead:
+                    submit_one()
+        if batch:
+            fetching.append([io_pool.submit(fetch, k) for k in batch])
+        while fetching:
+            submit_one()
+        while composing:
+            finish_one()
+
+    writer.close()
+    return writer.count, placed, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tile a prefix's labels onto print sheets or a multi-page PDF.")
+    parser.add_argument("prefix", help="S3 prefix, e.g. 2024/05/01/NewSales/")
+    parser.add_argument("out", help="Output .pdf file, or a directory for PNG sheets")
+    parser.add_argument("--term", help="Only include keys containing this text")
+    parser.add_argument("--bucket", default=DEFAULT_BUCKET)
+    parser.add_argument("--profile", default=DEFAULT_PROFILE)
+    parser.add_argument("--region")
+    parser.add_argument("--dpi", type=int, default=203)
+    parser.add_argument("--label-size", default="4x6", help="Label size in inches, WxH (default 4x6)")
+    parser.add_argument("--sheet", default="label", choices=["label", *SHEET_SIZES], help="'label' gives one label per page")
+    parser.add_argument("--margin", type=float, default=0.25, help="Sheet margin in inches")
+    parser.add_argument("--gap", type=float, default=0.1, help="Gap between labels in inches")
+    parser.add_argument("--workers", type=int, help="Compositor processes (default: CPU count)")
+    args = parser.parse_args()
+
+    session = boto3.Session(profile_name=args.profile or None, region_name=args.region)
+    s3 = CONTROLLER.client(session, args.region)
+    layout = build_layout(args.dpi, parse_size(args.label_size), args.sheet, args.margin, args.gap)
+    sheets, placed, failures = compose_print_run(s3, args.bucket, args.prefix, args.out, layout, args.dpi,
+                                         term=args.term, workers=args.workers)
+
+    print(f"Placed {placed} label(s) on {sheets} sheet(s) ({len(layout['origins'])} per sheet) in {args.out}")
+    for key, error in failures:
+        print(f"  FAILED {key}: {error}", file=sys.stderr)
+    CONTROLLER.report()
+    sys.exit(1 if failures else 0)
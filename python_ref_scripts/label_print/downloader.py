@@ -1,5 +1,5 @@
-import base64
 import os
+import sys
 import platform
 import tempfile
 import subprocess
@@ -12,6 +12,12 @@ import customtkinter as ctk
 from tkinter import ttk, messagebox, filedialog
 from PIL import Image, ImageTk
 
+# The label decoding and listing snapshot code is shared with the server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "server"))
+from decoding import decode_label_bytes
+from listing_snapshot import snapshot_for
+from listing_cache import ListingCache, needs_refresh
+
 APP_TITLE = "S3 Label Viewer (Base64 PNG)"
 DEFAULT_BUCKET = "pat-labels"
 DEFAULT_PROFILE = "gateway"
@@ -41,6 +47,7 @@ class S3LabelViewer(ctk.CTk):
         self.loading = False
         self.last_image = None
         self.last_image_key = ""
+        self.listing_cache = ListingCache()
 
         # Layout
         self.columnconfigure(0, weight=7)
@@ -163,7 +170,6 @@ class S3LabelViewer(ctk.CTk):
                 self.s3.head_bucket(Bucket=self.bucket)
                 self.current_prefix = ""
                 self.after(0, self._reset_tree_root)
-                self._list_prefix("")  # prime cache
             except Exception as e:
                 tb = traceback.format_exc(limit=1)
                 self.after(0, lambda e=e, tb=tb: messagebox.showerror("Connection error", f"{human_error(e)}\n\n{tb}"))
@@ -179,9 +185,28 @@ class S3LabelViewer(ctk.CTk):
         self.root_node = self.tree.insert("", "end", text=f"s3://{self.bucket}/", open=True, values=("dir", ""))
         self.tree.insert(self.root_node, "end", text="Loading...", values=("placeholder", ""))
         self.tree.item(self.root_node, open=True)
-        self.on_tree_expand(None, node=self.root_node)
+        prefix = self.current_prefix
+        self.on_tree_expand(None, node=self.root_node, then=lambda: self._reveal_prefix(self.root_node, prefix))
 
-    def on_tree_expand(self, event, node=None):
+    def _reveal_prefix(self, node, prefix: str):
+        """Opens the folders leading down to prefix and selects it, one level at a time."""
+        if not prefix:
+            return
+        for child in self.tree.get_children(node):
+            vals = self.tree.item(child, "values")
+            if not vals or vals[0] != "dir" or not prefix.startswith(str(vals[1])):
+                continue
+            self.tree.item(child, open=True)
+            if str(vals[1]) == prefix:
+                self.tree.selection_set(child)
+                self.tree.focus(child)
+                self.tree.see(child)
+                self.on_tree_expand(None, node=child)
+            else:
+                self.on_tree_expand(None, node=child, then=lambda c=child: self._reveal_prefix(c, prefix))
+            return
+
+    def on_tree_expand(self, event, node=None, then=None):
         if node is None:
             node = self.tree.focus() or self.root_node
         vals = self.tree.item(node, "values")
@@ -194,6 +219,19 @@ class S3LabelViewer(ctk.CTk):
         # Don't re-fetch if already populated, unless it's a placeholder
         children = self.tree.get_children(node)
         if children and self.tree.item(children[0], "values")[0] != "placeholder":
+            if then:
+                then()
+            return
+
+        # Show the last known listing straight away; re-list in the background only if it may be stale
+        cached = self.listing_cache.get(self.bucket, prefix)
+        if cached is not None:
+            folders, files, listed_at = cached
+            self._apply_listing(node, prefix, folders, files)
+            if then:
+                then()
+            if needs_refresh(prefix, listed_at):
+                self._revalidate(node, prefix)
             return
 
         for c in children:
@@ -206,14 +244,11 @@ class S3LabelViewer(ctk.CTk):
                 folders, files = self._list_prefix(prefix)
 
                 def populate():
-                    for f in folders:
-                        n = self.tree.insert(node, "end", text=f, values=("dir", prefix + f))
-                        self.tree.insert(n, "end", text="...", values=("placeholder", ""))
-                    for key in files:
-                        self.tree.insert(node, "end", text=key.split("/")[-1], values=("file", key))
-                    
+                    self._apply_listing(node, prefix, folders, files)
                     # Scroll back to the parent node that was expanded
                     self.tree.see(node)
+                    if then:
+                        then()
 
                 self.after(0, populate)
             except Exception as e:
@@ -223,6 +258,47 @@ class S3LabelViewer(ctk.CTk):
 
         threading.Thread(target=worker, daemon=True).start()
 
+    def _revalidate(self, node, prefix: str):
+        bucket = self.bucket
+
+        def worker():
+            try:
+                folders, files = self._list_prefix(prefix)
+            except Exception:
+                return  # Keep showing the cached listing
+            if bucket == self.bucket:
+                self.after(0, lambda: self._apply_listing(node, prefix, folders, files))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _apply_listing(self, node, prefix: str, folders, files):
+        """
+        Makes a folder node's children match a listing in place: new entries are
+        inserted at their sorted position and vanished ones removed, while
+        unchanged entries (and any folders expanded under them) are kept.
+        """
+        if not self.tree.exists(node):
+            return
+        existing = {}
+        for child in self.tree.get_children(node):
+            vals = self.tree.item(child, "values")
+            if vals and vals[0] in ("dir", "file"):
+                existing[(vals[0], str(vals[1]))] = child
+            else:
+                self.tree.delete(child)  # Placeholder
+        wanted = [("dir", prefix + f) for f in folders] + [("file", key) for key in files]
+        for entry in set(existing) - set(wanted):
+            self.tree.delete(existing.pop(entry))
+        for index, (node_type, path) in enumerate(wanted):
+            child = existing.get((node_type, path))
+            if child is None:
+                text = path[len(prefix):] if node_type == "dir" else path.split("/")[-1]
+                child = self.tree.insert(node, index, text=text, values=(node_type, path))
+                if node_type == "dir":
+                    self.tree.insert(child, "end", text="...", values=("placeholder", ""))
+            elif self.tree.index(child) != index:
+                self.tree.move(child, node, index)
+
     def on_tree_select(self, event):
         node = self.tree.focus()
         vals = self.tree.item(node, "values")
@@ -255,6 +331,11 @@ class S3LabelViewer(ctk.CTk):
         self.up_btn.configure(state="normal" if self.current_prefix else "disabled")
 
     def _list_prefix(self, prefix: str):
+        # Finalized days are read from their local listing snapshot without touching S3
+        snapshot = snapshot_for(self.bucket, prefix, lambda: self.s3)
+        if snapshot is not None:
+            return snapshot.listing(prefix)
+
         paginator = self.s3.get_paginator("list_objects_v2")
         folders = set()
         files = []
@@ -270,7 +351,9 @@ class S3LabelViewer(ctk.CTk):
                 if "/" in remainder:
                     continue
                 files.append(key)
-        return sorted(folders), sorted(files)
+        folders, files = sorted(folders), sorted(files)
+        self.listing_cache.put(self.bucket, prefix, folders, files)
+        return folders, files
 
     def _list_prefix_sorted(self, prefix: str):
         paginator = self.s3.get_paginator("list_objects_v2")
@@ -348,27 +431,7 @@ class S3LabelViewer(ctk.CTk):
                 obj = self.s3.get_object(Bucket=self.bucket, Key=key)
                 raw = obj["Body"].read()
 
-                img_bytes = None
-                try:
-                    text = raw.decode("utf-8", errors="strict").strip()
-                except UnicodeDecodeError:
-                    text = None
-
-                if raw.startswith(b"\x89PNG\r\n\x1a\n"):
-                    img_bytes = raw
-                elif text is not None:
-                    if text.startswith("data:image/png;base64,"):
-                        text = text.split(",", 1)[1].strip()
-                    b64 = "".join(text.split())
-                    try:
-                        img_bytes = base64.b64decode(b64, validate=True)
-                    except (base64.binascii.Error, ValueError):
-                        img_bytes = base64.b64decode(b64, validate=False)
-                else:
-                    try:
-                        img_bytes = base64.b64decode(raw, validate=True)
-                    except Exception:
-                        img_bytes = raw
+                img_bytes = decode_label_bytes(raw)
 
                 image = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
                 self.last_image = image.copy()
@@ -0,0 +1,84 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from listing_snapshot import SETTLE_HOURS
+
+CACHE_DB = os.environ.get("S3_VIEWER_CACHE_DB", os.path.join(os.path.expanduser("~"), ".s3_label_viewer_cache.sqlite"))
+DATE_PREFIX = re.compile(r"^(\d{4})/(?:(\d{2})/(?:(\d{2})/)?)?")
+
+
+def partition_end(prefix: str):
+    """
+    Returns when the YYYY/, YYYY/MM/ or YYYY/MM/DD/ partition a prefix falls
+    within ends, or None for prefixes outside the date hierarchy (including the root).
+    """
+    match = DATE_PREFIX.match(prefix)
+    if not match:
+        return None
+    year, month, day = (int(part) if part else None for part in match.groups())
+    try:
+        if day:
+            return datetime(year, month, day) + timedelta(days=1)
+        if month:
+            return datetime(year + month // 12, month % 12 + 1, 1)
+        return datetime(year + 1, 1, 1)
+    except ValueError:
+        return None
+
+
+def needs_refresh(prefix: str, listed_at: float) -> bool:
+    """
+    Whether a cached listing could be out of date. Labels only land in the
+    newest date partitions, so a listing taken after its partition ended (plus
+    SETTLE_HOURS) is final; everything else is re-listed.
+    """
+    end = partition_end(prefix)
+    return end is None or listed_at < (end + timedelta(hours=SETTLE_HOURS)).timestamp()
+
+
+class ListingCache:
+    """
+    Per-bucket delimiter listings (folders and files directly under a prefix)
+    persisted in a local SQLite file, so the viewer can render a folder before
+    S3 answers. Safe to use from the UI thread and worker threads.
+    """
+
+    def __init__(self, path: str = CACHE_DB):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS listings (
+                bucket TEXT NOT NULL,
+                prefix TEXT NOT NULL,
+                folders TEXT NOT NULL,
+                files TEXT NOT NULL,
+                listed_at REAL NOT NULL,
+                PRIMARY KEY (bucket, prefix)
+            )
+        """)
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def get(self, bucket: str, prefix: str):
+        """Returns the cached (folders, files, listed_at) for prefix, or None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT folders, files, listed_at FROM listings WHERE bucket = ? AND prefix = ?", (bucket, prefix)
+            ).fetchone()
+        return (json.loads(row[0]), json.loads(row[1]), row[2]) if row else None
+
+    def put(self, bucket: str, prefix: str, folders, files):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO listings (bucket, prefix, folders, files, listed_at) VALUES (?, ?, ?, ?, ?)",
+                (bucket, prefix, json.dumps(list(folders)), json.dumps(list(files)), time.time()),
+            )
+            self.db.commit()
@@ -0,0 +1,33 @@
+import os
+import stat
+
+# Per-user root for on-disk caches. Never a shared directory like /tmp, where
+# another local user could create the directory first and plant entries.
+CACHE_ROOT = os.environ.get(
+    "WEBTOOLS2_CACHE_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "webtools2"),
+)
+
+
+def _is_private(st) -> bool:
+    getuid = getattr(os, "getuid", None)  # Not available on Windows, where there's no shared /tmp either
+    if getuid is None:
+        return True
+    return st.st_uid == getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def private_dir(path: str) -> str:
+    """
+    Creates path (mode 0700) if needed and returns it. Raises PermissionError
+    if it is a symlink, not owned by us, or writable by anyone else.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or not _is_private(st):
+        raise PermissionError(f"Refusing to use cache directory {path}: not a private directory owned by this user")
+    return path
+
+
+def owned_file(f) -> bool:
+    """Whether an open cache file belongs to us and can't have been written by anyone else."""
+    return _is_private(os.fstat(f.fileno()))
@@ -0,0 +1,91 @@
+# Start-up budget check for s3_downloader_api.py, which Node spawns per request.
+# This is the enforcement point for the budgets below: CI runs it (npm run
+# check:coldstart) and fails the build when it exits non-zero.
+import os
+import subprocess
+import sys
+import time
+
+# Wall-clock budget (ms) for a fresh interpreter to be ready to make its first
+# S3 call for each command. Measured on a dev machine; scale with
+# COLDSTART_BUDGET_SCALE on slower hosts such as the Raspberry Pi.
+BUDGETS_MS = {
+    "list": 600,
+    "search": 600,
+    "get_image": 700,
+    "probe": 600,
+    "export": 600,
+}
+RUNS = int(os.environ.get("COLDSTART_RUNS", "5"))
+SCALE = float(os.environ.get("COLDSTART_BUDGET_SCALE", "1"))
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in the child: everything a command does before its first request
+CHILD_CODE = """
+import sys
+sys.path.insert(0, {server_dir!r})
+import s3_downloader_api
+s3_downloader_api.preload_command({command!r})
+import botocore.session
+s3_downloader_api.CONTROLLER.client(botocore.session.Session(), "us-east-1")
+"""
+
+
+def parse_importtime(stderr: str, top: int = 8):
+    """
+    Returns the modules with the highest self time as (module, self_ms) from
+    `python -X importtime` output.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue  # Header line
+        imports.append((name.strip(), int(self_us) / 1000))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def measure(command: str):
+    """
+    Returns (best wall-clock ms over RUNS, slowest imports). The budget is
+    checked against plain runs; one extra run with -X importtime gives the
+    breakdown, since importtime itself slows the interpreter down.
+    """
+    env = {
+        **os.environ,
+        # Dummy credentials keep the provider chain from probing instance metadata
+        "AWS_ACCESS_KEY_ID": "coldstart",
+        "AWS_SECRET_ACCESS_KEY": "coldstart",
+    }
+    env.pop("AWS_PROFILE", None)
+    code = CHILD_CODE.format(server_dir=SERVER_DIR, command=command)
+
+    def run(*flags):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, *flags, "-c", code], env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{command}: cold start failed:\n{proc.stderr[-2000:]}")
+        return (time.perf_counter() - start) * 1000, proc.stderr
+
+    best = min(run()[0] for _ in range(RUNS))
+    return best, parse_importtime(run("-X", "importtime")[1])
+
+
+if __name__ == "__main__":
+    commands = sys.argv[1:] or list(BUDGETS_MS)
+    # Warm the botocore model cache so every command is measured the same way
+    measure(commands[0])
+
+    failed = False
+    for command in commands:
+        elapsed, imports = measure(command)
+        budget = BUDGETS_MS[command] * SCALE
+        ok = elapsed <= budget
+        failed |= not ok
+        print(f"{command:<10} {elapsed:7.0f} ms / {budget:5.0f} ms  {'ok' if ok else 'OVER BUDGET'}")
+        for module, ms in imports:
+            print(f"    {ms:7.1f} ms self  {module}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,30 @@
+import base64
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def decode_label_bytes(raw: bytes) -> bytes:
+    """
+    Returns PNG bytes for a label object stored either as raw PNG or as base64
+    text (optionally a data: URL).
+    """
+    try:
+        text = raw.decode("utf-8", errors="strict").strip()
+    except UnicodeDecodeError:
+        text = None
+
+    if raw.startswith(PNG_SIGNATURE):
+        return raw
+    elif text is not None:
+        if text.startswith("data:image/png;base64,"):
+            text = text.split(",", 1)[1].strip()
+        b64 = "".join(text.split())
+        try:
+            return base64.b64decode(b64, validate=True)
+        except (base64.binascii.Error, ValueError):
+            return base64.b64decode(b64, validate=False)
+    else:
+        try:
+            return base64.b64decode(raw, validate=True)
+        except Exception:
+            return raw
@@ -268,18 +268,18 @@ app.get('/api/s3-summary', authorize('USER', '/s3-summary'), (req, res) => { //
   });                                                                                            
 });                                                                                              
                                                                                                  
-app.get('/api/label-summary', authorize('USER', '/label-summary'), async (req, res) => {
-  const getNextWorkingDay = (date) => {
-    const nextDay = new Date(date);
-    nextDay.setDate(date.getDate() + 1);
-    if (nextDay.getDay() === 6) { // Saturday
-      nextDay.setDate(nextDay.getDate() + 2);
-    } else if (nextDay.getDay() === 0) { // Sunday
-      nextDay.setDate(nextDay.getDate() + 1);
-    }
-    return nextDay;
-  };
+const getNextWorkingDay = (date) => {
+  const nextDay = new Date(date);
+  nextDay.setDate(date.getDate() + 1);
+  if (nextDay.getDay() === 6) { // Saturday
+    nextDay.setDate(nextDay.getDate() + 2);
+  } else if (nextDay.getDay() === 0) { // Sunday
+    nextDay.setDate(nextDay.getDate() + 1);
+  }
+  return nextDay;
+};
 
+app.get('/api/label-summary', authorize('USER', '/label-summary'), async (req, res) => {
   const runLabelScript = (dateStr) => {
     return new Promise((resolve, reject) => {
       const args = dateStr ? ['--screen', dateStr] : ['--screen'];
@@ -412,18 +412,162 @@ app.get('/api/s3-downloader/search', authorize('USER', '/s3-downloader'), async
   }
 });
 
+// Background jobs (server/jobs.py): submitting returns a job ID straight away, and the
+// job's progress and result can then be polled or streamed as NDJSON.
+const registerJobRoutes = (basePath, pagePath, kind) => {
+  app.get(`${basePath}/:jobId`, authorize('USER', pagePath), async (req, res) => {
+    try {
+      const { status, data } = await executePythonScript('./server/jobs.py', ['status', req.params.jobId, kind], req, res);
+      res.status(data.error && !data.kind ? 404 : status).json(data);
+    } catch (error) {
+      res.status(error.status || 500).json({ message: error.message, error: error.error, pythonOutput: error.pythonOutput, pythonError: error.pythonError });
+    }
+  });
+
+  app.get(`${basePath}/:jobId/stream`, authorize('USER', pagePath), (req, res) => {
+    const pythonProcess = spawn('./venv_s3/bin/python', ['./server/jobs.py', 'stream', req.params.jobId, kind], {
+      env: { ...process.env, PYTHONUNBUFFERED: '1' }
+    });
+    res.setHeader('Content-Type', 'application/x-ndjson');
+    pythonProcess.stdout.pipe(res);
+    pythonProcess.stderr.on('data', (data) => {
+      console.error(`Job stream stderr: ${data.toString()}`);
+    });
+    // Only the watcher stops; the job itself keeps running
+    res.on('close', () => {
+      if (!res.writableEnded) pythonProcess.kill();
+    });
+    pythonProcess.on('error', (err) => {
+      console.error('Failed to start Python child process:', err);
+      if (!res.headersSent) {
+        res.status(500).json({ message: 'Failed to start Python process', error: err.message });
+      } else {
+        res.end();
+      }
+    });
+  });
+};
+
+app.post('/api/label-summary/jobs', authorize('USER', '/label-summary'), async (req, res) => {
+  const today = new Date();
+  const todayStr = today.toISOString().split('T')[0];
+  const nextWorkingDayStr = getNextWorkingDay(today).toISOString().split('T')[0];
+  try {
+    const [todayJob, nextDayJob] = await Promise.all([
+      executePythonScript('./server/jobs.py', ['submit', 'label-summary', todayStr], req, res),
+      executePythonScript('./server/jobs.py', ['submit', 'label-summary', nextWorkingDayStr], req, res)
+    ]);
+    res.status(202).json({ todayJob: todayJob.data, nextDayJob: nextDayJob.data });
+  } catch (error) {
+    res.status(error.status || 500).json({ message: error.message, error: error.error, pythonOutput: error.pythonOutput, pythonError: error.pythonError });
+  }
+});
+registerJobRoutes('/api/label-summary/jobs', '/label-summary', 'label-summary');
+
+app.post('/api/s3-downloader/search/jobs', authorize('USER', '/s3-downloader'), async (req, res) => {
+  const { bucket, prefix = "", term } = req.query;
+  if (!bucket || !term) {
+    return res.status(400).json({ message: 'Bucket and search term are required' });
+  }
+  try {
+    const { data } = await executePythonScript('./server/jobs.py', ['submit', 'search', bucket, prefix, term], req, res);
+    res.status(202).json(data);
+  } catch (error) {
+    res.status(error.status || 500).json({ message: error.message, error: error.error, pythonOutput: error.pythonOutput, pythonError: error.pythonError });
+  }
+});
+registerJobRoutes('/api/s3-downloader/search/jobs', '/s3-downloader', 'search');
+
 app.get('/api/s3-downloader/image', authorize('USER', '/s3-downloader'), async (req, res) => {
-  const { bucket, key } = req.query;
+  const { bucket, key, encoding = "", effort = "" } = req.query;
   if (!bucket || !key) {
     return res.status(400).json({ message: 'Bucket and key are required' });
   }
   try {
-    const { status, data } = await executePythonScript('./server/s3_downloader_api.py', ['get_image', bucket, key], req, res);
+    const { status, data } = await executePythonScript('./server/s3_downloader_api.py', ['get_image', bucket, key, encoding, effort], req, res);
     res.status(status).json(data);
   } catch (error) {
     res.status(error.status || 500).json({ message: error.message, error: error.error, pythonOutput: error.pythonOutput, pythonError: error.pythonError });
   }
 });                                                                                                 
+
+app.get('/api/s3-downloader/probe', authorize('USER', '/s3-downloader'), async (req, res) => {
+  const { bucket, prefix = "", term = "" } = req.query;
+  if (!bucket) {
+    return res.status(400).json({ message: 'Bucket is required' });
+  }
+  try {
+    const { status, data } = await executePythonScript('./server/s3_downloader_api.py', ['probe', bucket, prefix, term], req, res);
+    res.status(status).json(data);
+  } catch (error) {
+    res.status(error.status || 500).json({ message: error.message, error: error.error, pythonOutput: error.pythonOutput, pythonError: error.pythonError });
+  }
+});
+
+app.get('/api/s3-downloader/qa', authorize('USER', '/s3-downloader'), async (req, res) => {
+  const { bucket, prefix, expected } = req.query;
+  if (!bucket || !prefix) {
+    return res.status(400).json({ message: 'Bucket and prefix are required' });
+  }
+  const args = expected ? [bucket, prefix, expected] : [bucket, prefix];
+  try {
+    const { status, data } = await executePythonScript('./server/label_qa.py', args, req, res);
+    res.status(status).json(data);
+  } catch (error) {
+    res.status(error.status || 500).json({ message: error.message, error: error.error, pythonOutput: error.pythonOutput, pythonError: error.pythonError });
+  }
+});
+
+app.get('/api/s3-downloader/export', authorize('USER', '/s3-downloader'), (req, res) => {
+  const { bucket, prefix = "", term = "", profile, region } = req.query;
+  if (!bucket) {
+    return res.status(400).json({ message: 'Bucket is required' });
+  }
+  const env = {
+    ...process.env,
+    PYTHONUNBUFFERED: '1'
+  };
+  if (profile) env.AWS_PROFILE = profile;
+  if (region) env.AWS_REGION = region;
+
+  // The ZIP is streamed straight from Python's stdout, so this can't go through executePythonScript
+  const pythonProcess = spawn('./venv_s3/bin/python', ['./server/s3_downloader_api.py', 'export', bucket, prefix, term], { env });
+  const archiveName = `${(prefix || bucket).replace(/\/+$/, '').replace(/[^A-Za-z0-9_-]+/g, '_') || 'labels'}.zip`;
+  res.setHeader('Content-Type', 'application/zip');
+  res.setHeader('Content-Disposition', `attachment; filename="${archiveName}"`);
+  pythonProcess.stdout.pipe(res, { end: false });
+
+  let pythonError = '';
+  pythonProcess.stderr.on('data', (data) => {
+    pythonError += data.toString();
+  });
+
+  // Stop fetching if the client goes away mid-download
+  res.on('close', () => {
+    if (!res.writableEnded) pythonProcess.kill();
+  });
+
+  pythonProcess.on('close', (code) => {
+    if (code === 0) {
+      return res.end();
+    }
+    console.error(`Export script exited with code ${code}: ${pythonError}`);
+    if (res.headersSent) {
+      // Part of the archive is already out; abort so the client sees a failed download
+      return res.destroy();
+    }
+    res.removeHeader('Content-Disposition');
+    res.status(500).json({ message: 'Failed to export labels', error: pythonError });
+  });
+
+  pythonProcess.on('error', (err) => {
+    console.error('Failed to start Python child process:', err);
+    if (!res.headersSent) {
+      res.removeHeader('Content-Disposition');
+      res.status(500).json({ message: 'Failed to start Python process', error: err.message });
+    }
+  });
+});
                                                                                                  
                                                                                                  
 // Production-specific logic                                                                     
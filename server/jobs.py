@@ -0,0 +1,301 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from cache_paths import CACHE_ROOT, private_dir
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SERVER_DIR)
+# Defaults to the private per-user cache root, where no other user can plant job results
+JOB_DB = os.environ.get("S3_JOB_DB")
+# Finished jobs are kept (and reused by identical submissions) for this long
+RESULT_TTL = float(os.environ.get("S3_JOB_TTL", "600"))
+POLL_SECONDS = 0.5
+# A queued job whose submitter never recorded a runner pid within this long is dead
+START_GRACE_SECONDS = 10
+FINISHED = ("done", "error")
+
+# Job kind -> (argv builder, whether stdout is JSON). Each runs as its own
+# process, exactly as the synchronous endpoints run it.
+JOB_COMMANDS = {
+    "label-summary": (
+        lambda date: [os.path.join("server", "python_ref_scripts", "label_summary", "combined_counter2.py"), "--screen", date],
+        False,
+    ),
+    "search": (
+        lambda bucket, prefix, term: [os.path.join("server", "s3_downloader_api.py"), "search", bucket, prefix, term],
+        True,
+    ),
+}
+
+
+def human_error(e: Exception) -> str:
+    return f"{type(e).__name__}: {str(e) or 'No details'}"
+
+
+class JobStore:
+    """
+    SQLite-backed record of background jobs: their state, listing progress and
+    result. Shared by the submitting process, the runner and status readers.
+    """
+
+    def __init__(self, path: str = None):
+        path = path or JOB_DB or os.path.join(private_dir(CACHE_ROOT), "jobs.sqlite")
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                pages_listed INTEGER NOT NULL DEFAULT 0,
+                keys_scanned INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                pid INTEGER,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_params ON jobs (params);
+        """)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def claim(self, kind: str, params: str):
+        """
+        Returns (job_id, created): the id of an unfinished or recently finished
+        job with the same parameters, or of a new queued job. The lookup and the
+        insert run in one write transaction, so concurrent identical submissions
+        (from any process) agree on a single job.
+        """
+        self.db.commit()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                "SELECT id, status, pid, created_at FROM jobs WHERE params = ? AND status != 'error' "
+                "ORDER BY created_at DESC LIMIT 1",
+                (params,),
+            ).fetchone()
+            if row and not _runner_lost(row):
+                self.db.commit()
+                return row["id"], False
+            if row:
+                self.db.execute(
+                    "UPDATE jobs SET status = 'error', error = ?, finished_at = ? WHERE id = ?",
+                    ("Job runner exited unexpectedly", time.time(), row["id"]),
+                )
+            job_id = uuid.uuid4().hex
+            self.db.execute(
+                "INSERT INTO jobs (id, kind, params, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, kind, params, time.time()),
+            )
+            self.db.commit()
+            return job_id, True
+        except BaseException:
+            self.db.rollback()
+            raise
+
+    def update(self, job_id: str, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self.db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        self.db.commit()
+
+    def finish(self, job_id: str, result=None, error: str = None):
+        self.update(
+            job_id,
+            status="error" if error else "done",
+            result=None if error else json.dumps(result),
+            error=error,
+            finished_at=time.time(),
+        )
+
+    def purge(self):
+        self.db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (time.time() - RESULT_TTL,))
+        self.db.commit()
+
+    def get(self, job_id: str, kind: str = None):
+        """Returns the job's status, or None if it is unknown, expired or not of the given kind."""
+        row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (kind and row["kind"] != kind):
+            return None
+        if _runner_lost(row):
+            self.finish(job_id, error="Job runner exited unexpectedly")
+            return self.get(job_id, kind)
+        status = {
+            "jobId": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": {"pagesListed": row["pages_listed"], "keysScanned": row["keys_scanned"]},
+            "createdAt": row["created_at"],
+            "finishedAt": row["finished_at"],
+        }
+        if row["status"] == "done":
+            status["result"] = json.loads(row["result"])
+        elif row["status"] == "error":
+            status["error"] = row["error"]
+        return status
+
+
+def _runner_lost(row) -> bool:
+    """
+    Whether an unfinished job has no live runner: its runner exited, or the
+    submitter died before starting one.
+    """
+    if row["status"] in FINISHED:
+        return False
+    if row["pid"]:
+        return not _pid_alive(row["pid"])
+    return time.time() - row["created_at"] > START_GRACE_SECONDS
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def submit(store: JobStore, kind: str, args):
+    """
+    Starts a job in a detached runner process and returns its status straight
+    away. An identical job that is still running, or finished within
+    RESULT_TTL, is returned instead of starting a new walk.
+    """
+    if kind not in JOB_COMMANDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    try:
+        JOB_COMMANDS[kind][0](*args)
+    except TypeError:
+        raise ValueError(f"Wrong number of arguments for a {kind} job")
+    store.purge()
+    # The runner inherits this environment, so the AWS profile and region are part of the job
+    params = json.dumps([kind, *args, os.environ.get("AWS_PROFILE"), os.environ.get("AWS_REGION")])
+    job_id, created = store.claim(kind, params)
+    if created:
+        try:
+            runner = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "run", job_id],
+                cwd=REPO_DIR,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,  # Outlive the request that submitted it
+            )
+        except OSError as e:
+            # Otherwise the queued job would be handed to every identical submission
+            store.finish(job_id, error=human_error(e))
+            raise
+        store.update(job_id, pid=runner.pid)
+    return store.get(job_id)
+
+
+def _read_progress(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def run(store: JobStore, job_id: str):
+    """Runner process: executes the job's command and records progress and result."""
+    row = store.db.execute("SELECT kind, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    kind = row["kind"]
+    args = json.loads(row["params"])[1:-2]
+    build_argv, json_output = JOB_COMMANDS[kind]
+    store.update(job_id, status="running", pid=os.getpid())
+
+    progress_file = os.path.join(private_dir(CACHE_ROOT), f"job-{job_id}.progress")
+    env = {**os.environ, "PYTHONUNBUFFERED": "1", "S3_PROGRESS_FILE": progress_file}
+    try:
+        with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+            proc = subprocess.Popen([sys.executable, *build_argv(*args)], cwd=REPO_DIR, env=env,
+                                    stdout=stdout, stderr=stderr)
+            while True:
+                try:
+                    code = proc.wait(timeout=POLL_SECONDS)
+                except subprocess.TimeoutExpired:
+                    code = None
+                progress = _read_progress(progress_file)
+                if progress:
+                    store.update(job_id, pages_listed=progress["pagesListed"], keys_scanned=progress["keysScanned"])
+                if code is not None:
+                    break
+            stdout.seek(0)
+            stderr.seek(0)
+            output = stdout.read().decode("utf-8", errors="replace")
+            errors = stderr.read().decode("utf-8", errors="replace")
+
+        if not json_output:
+            if code != 0:
+                raise RuntimeError(errors.strip()[-2000:] or f"Exited with code {code}")
+            store.finish(job_id, output)
+            return
+        result = json.loads(output) if output.strip() else None
+        if code != 0 or (isinstance(result, dict) and "error" in result):
+            error = result.get("error") if isinstance(result, dict) else None
+            raise RuntimeError(error or errors.strip()[-2000:] or f"Exited with code {code}")
+        store.finish(job_id, result)
+    except Exception as e:
+        store.finish(job_id, error=human_error(e))
+    finally:
+        try:
+            os.remove(progress_file)
+        except OSError:
+            pass
+
+
+def unknown_job(job_id: str) -> dict:
+    return {"jobId": job_id, "status": "error", "error": "Unknown or expired job"}
+
+
+def stream(store: JobStore, job_id: str, kind: str = None):
+    """Prints the job's status as a JSON line whenever it changes, until it finishes."""
+    last = None
+    while True:
+        status = store.get(job_id, kind)
+        if status is None:
+            print(json.dumps(unknown_job(job_id)), flush=True)
+            return
+        if status != last:
+            print(json.dumps(status), flush=True)
+            last = status
+        if status["status"] in FINISHED:
+            return
+        time.sleep(POLL_SECONDS)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    store = JobStore()
+    try:
+        if command == "submit":
+            result = submit(store, sys.argv[2], sys.argv[3:])
+        elif command == "status":
+            kind = sys.argv[3] if len(sys.argv) > 3 else None
+            result = store.get(sys.argv[2], kind) or unknown_job(sys.argv[2])
+        elif command == "stream":
+            stream(store, sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+            sys.exit(0)
+        elif command == "run":
+            run(store, sys.argv[2])
+            sys.exit(0)
+        else:
+            result = {"error": "Usage: jobs.py submit KIND ARGS... | status JOB_ID [KIND] | stream JOB_ID [KIND]"}
+        print(json.dumps(result))
+    except Exception as e:
+        print(json.dumps({"error": human_error(e)}))
+        sys.exit(1)
+    finally:
+        store.close()
@@ -0,0 +1,187 @@
+import hashlib
+import io
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from botocore.exceptions import ClientError
+from PIL import Image
+from s3_controller import CONTROLLER
+from s3_downloader_api import decode_label_bytes, get_s3_client, human_error, iter_png_keys
+
+BATCH_SIZE = int(os.environ.get("QA_BATCH_SIZE", "32"))
+# Fraction of dark pixels below which a label counts as blank, and above which as solid
+BLANK_COVERAGE = float(os.environ.get("QA_BLANK_COVERAGE", "0.002"))
+SOLID_COVERAGE = float(os.environ.get("QA_SOLID_COVERAGE", "0.9"))
+INK_THRESHOLD = 128  # Grey levels below this count as ink
+
+
+def load_pixels(raw: bytes):
+    """
+    Decodes a label to a (height, width, 2) greyscale + alpha array. Raises
+    ValueError for truncated or undecodable images.
+    """
+    png = decode_label_bytes(raw)
+    if b"IEND" not in png[-64:]:
+        raise ValueError("PNG is truncated (no IEND chunk)")
+    image = Image.open(io.BytesIO(png))
+    image.load()  # Forces a full decode so truncated image data raises here
+    return np.asarray(image.convert("LA"))
+
+
+def analyze_batch(items):
+    """
+    Process-pool worker: returns one row per (key, raw_bytes, fetch_error) with
+    dimensions, ink coverage, ink bounding box and a hash of the ink. Labels of
+    the same size are stacked and measured together as one array.
+    """
+    rows = {}
+    by_shape = defaultdict(list)
+    for key, raw, fetch_error in items:
+        if fetch_error:
+            rows[key] = {"key": key, "fetchError": fetch_error}
+            continue
+        try:
+            pixels = load_pixels(raw)
+        except Exception as e:
+            rows[key] = {"key": key, "error": human_error(e)}
+            continue
+        by_shape[pixels.shape[:2]].append((key, pixels))
+
+    for (height, width), group in by_shape.items():
+        stacked = np.stack([pixels for _, pixels in group])  # (n, height, width, 2)
+        # Ink is dark and mostly opaque, i.e. dark once flattened onto white paper
+        ink = (stacked[..., 0] < INK_THRESHOLD) & (stacked[..., 1] >= 128)  # (n, height, width)
+        coverage = np.count_nonzero(ink, axis=(1, 2)) / (height * width)
+        ink_rows = ink.any(axis=2)  # (n, height)
+        ink_cols = ink.any(axis=1)  # (n, width)
+        has_ink = ink_rows.any(axis=1)
+        top = ink_rows.argmax(axis=1)
+        bottom = height - 1 - ink_rows[:, ::-1].argmax(axis=1)
+        left = ink_cols.argmax(axis=1)
+        right = width - 1 - ink_cols[:, ::-1].argmax(axis=1)
+        # Duplicates are labels that print identically, so hash the size and bit-packed ink mask
+        packed = np.packbits(ink.reshape(len(group), -1), axis=1)
+        size_tag = f"{width}x{height}:".encode("ascii")
+
+        for i, (key, _) in enumerate(group):
+            rows[key] = {
+                "key": key,
+                "width": width,
+                "height": height,
+                "inkCoverage": round(float(coverage[i]), 5),
+                "bbox": [int(left[i]), int(top[i]), int(right[i]), int(bottom[i])] if has_ink[i] else None,
+                "hash": hashlib.blake2b(size_tag + packed[i].tobytes(), digest_size=16).hexdigest(),
+            }
+    return [rows[key] for key, _, _ in items]
+
+
+def find_anomalies(rows, expected_size=None):
+    """
+    Flags blank, solid, truncated/undecodable, wrong-size and duplicate labels,
+    and labels that couldn't be downloaded. Without an expected size, the most
+    common size among the rows is used.
+    """
+    sizes = Counter((row["width"], row["height"]) for row in rows if "hash" in row)
+    if expected_size is None and sizes:
+        expected_size = sizes.most_common(1)[0][0]
+
+    by_hash = defaultdict(list)
+    for row in rows:
+        # Blank labels all look alike; they're reported as blank, not as duplicates of each other
+        if "hash" in row and row["bbox"] is not None:
+            by_hash[row["hash"]].append(row["key"])
+    duplicates = [sorted(keys) for keys in by_hash.values() if len(keys) > 1]
+    duplicate_of = {key: group for group in duplicates for key in group}
+
+    anomalies = []
+    for row in rows:
+        issues = []
+        if "fetchError" in row:
+            issues.append("fetch-error")
+        elif "error" in row:
+            issues.append("truncated")
+        else:
+            if row["inkCoverage"] < BLANK_COVERAGE:
+                issues.append("blank")
+            elif row["inkCoverage"] > SOLID_COVERAGE:
+                issues.append("solid")
+            if expected_size and (row["width"], row["height"]) != tuple(expected_size):
+                issues.append("wrong-size")
+            if row["key"] in duplicate_of:
+                issues.append("duplicate")
+        if issues:
+            anomaly = {k: v for k, v in row.items() if k != "hash"}
+            anomaly["issues"] = issues
+            if "duplicate" in issues:
+                anomaly["duplicateOf"] = [k for k in duplicate_of[row["key"]] if k != row["key"]]
+            anomalies.append(anomaly)
+
+    return {
+        "checked": len(rows),
+        "expectedSize": list(expected_size) if expected_size else None,
+        "sizes": {f"{w}x{h}": count for (w, h), count in sizes.most_common()},
+        "anomalies": anomalies,
+    }
+
+
+def check_labels(bucket: str, prefix: str, expected_size=None, profile: str = None, region: str = None,
+                 workers: int = None):
+    """
+    Runs the QA checks over every PNG under prefix. Downloads go through the
+    S3 controller's thread pool while decoding and measuring run in a process
+    pool, a batch at a time.
+    """
+    s3 = get_s3_client(profile, region)
+    workers = workers or os.cpu_count() or 1
+
+    def fetch(key):
+        try:
+            return key, s3.get_object(Bucket=bucket, Key=key)["Body"].read(), None
+        except ClientError as e:
+            error = e.response.get("Error", {})
+            return key, None, f"S3 error [{error.get('Code', 'Unknown')}]: {error.get('Message') or human_error(e)}"
+        except Exception as e:
+            return key, None, human_error(e)
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        batch = []
+
+        def submit():
+            pending.append(pool.submit(analyze_batch, CONTROLLER.map(fetch, batch)))
+            # Bound memory: keep at most two batches per worker in flight
+            while len(pending) > workers * 2:
+                rows.extend(pending.pop(0).result())
+
+        for key in iter_png_keys(s3, bucket, prefix):
+            batch.append(key)
+            if len(batch) == BATCH_SIZE:
+                submit()
+                batch = []
+        if batch:
+            submit()
+        for future in pending:
+            rows.extend(future.result())
+
+    return find_anomalies(rows, expected_size)
+
+
+if __name__ == "__main__":
+    profile = os.environ.get("AWS_PROFILE")
+    region = os.environ.get("AWS_REGION")
+
+    try:
+        bucket = sys.argv[1]
+        prefix = sys.argv[2]
+        expected = tuple(int(v) for v in sys.argv[3].lower().split("x")) if len(sys.argv) > 3 else None
+        result = check_labels(bucket, prefix, expected, profile, region)
+        print(json.dumps(result))
+        CONTROLLER.report()
+    except Exception as e:
+        print(json.dumps({"error": human_error(e)}))
+        CONTROLLER.report()
+        sys.exit(1)
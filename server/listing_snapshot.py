@@ -0,0 +1,271 @@
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+if __package__:
+    from .cache_paths import CACHE_ROOT, private_dir, owned_file
+else:
+    from cache_paths import CACHE_ROOT, private_dir, owned_file
+
+SNAPSHOT_DIR = os.environ.get("S3_SNAPSHOT_DIR", os.path.join(CACHE_ROOT, "snapshots"))
+ENABLED = os.environ.get("S3_SNAPSHOTS", "1") != "0"
+# A day is finalized (and safe to snapshot) this long after it ends
+SETTLE_HOURS = float(os.environ.get("S3_SNAPSHOT_SETTLE_HOURS", "6"))
+
+DAY_PATTERN = re.compile(r"^\d{4}/\d{2}/\d{2}/")
+MAGIC = b"S3SNAP01"
+# magic, object count, built at (epoch seconds), key suffix blob length, ETag blob length
+HEADER = struct.Struct("<8sI4xqQQ")
+
+_open_snapshots = {}
+_lock = threading.Lock()
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _layout(count: int, suffix_len: int, etag_len: int):
+    """Returns the byte offset of each column, in file order, and the file size."""
+    offsets = {}
+    position = HEADER.size
+    for name, size in (
+        ("suffix_offsets", 4 * (count + 1)),
+        ("etag_offsets", 4 * (count + 1)),
+        ("sizes", 8 * count),
+        ("last_modified", 8 * count),
+        ("suffixes", suffix_len),
+        ("etags", etag_len),
+    ):
+        position = _align(position)
+        offsets[name] = position
+        position += size
+    return offsets, position
+
+
+class ListingSnapshot:
+    """
+    Read-only view of one day partition's listing, memory-mapped from a
+    snapshot file. Objects are stored sorted by key as columns: key suffixes
+    (relative to the day prefix), sizes, LastModified (epoch ms) and ETags.
+    """
+
+    def __init__(self, path: str, day: str):
+        self.day = day
+        with open(path, "rb") as f:
+            if not owned_file(f):
+                raise PermissionError(f"Refusing to read {path}: not owned by this user")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.built_at, suffix_len, etag_len = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a listing snapshot")
+        offsets, _ = _layout(self.count, suffix_len, etag_len)
+        view = memoryview(self._map)
+        n = self.count
+        self._suffix_offsets = view[offsets["suffix_offsets"]:offsets["suffix_offsets"] + 4 * (n + 1)].cast("I")
+        self._etag_offsets = view[offsets["etag_offsets"]:offsets["etag_offsets"] + 4 * (n + 1)].cast("I")
+        self.sizes = view[offsets["sizes"]:offsets["sizes"] + 8 * n].cast("q")
+        self.last_modified = view[offsets["last_modified"]:offsets["last_modified"] + 8 * n].cast("q")
+        self._suffixes = view[offsets["suffixes"]:offsets["suffixes"] + suffix_len]
+        self._etags = view[offsets["etags"]:offsets["etags"] + etag_len]
+
+    def close(self):
+        self._suffix_offsets = self._etag_offsets = self.sizes = self.last_modified = None
+        self._suffixes = self._etags = None
+        self._map.close()
+
+    def __len__(self):
+        return self.count
+
+    def _suffix(self, i: int) -> bytes:
+        return bytes(self._suffixes[self._suffix_offsets[i]:self._suffix_offsets[i + 1]])
+
+    def key(self, i: int) -> str:
+        return self.day + self._suffix(i).decode("utf-8")
+
+    def etag(self, i: int) -> str:
+        return bytes(self._etags[self._etag_offsets[i]:self._etag_offsets[i + 1]]).decode("utf-8")
+
+    def _lower_bound(self, target: bytes, lo: int = 0) -> int:
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._suffix(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, prefix: str):
+        """Returns the (start, stop) index range of keys under prefix."""
+        sub = prefix[len(self.day):].encode("utf-8")
+        start = self._lower_bound(sub)
+        # Keys sharing a prefix are contiguous and end before the prefix with its
+        # last byte bumped (0xFF never occurs in UTF-8, so this can't overflow)
+        stop = self._lower_bound(sub[:-1] + bytes([sub[-1] + 1]), start) if sub else self.count
+        return start, stop
+
+    def listing(self, prefix: str):
+        """
+        Returns (folders, files) directly under prefix, like list_objects_v2
+        with Delimiter="/": folder names relative to prefix, files as full keys.
+        """
+        start, stop = self.range(prefix)
+        base = len(prefix[len(self.day):].encode("utf-8"))
+        folders, files = [], []
+        i = start
+        while i < stop:
+            suffix = self._suffix(i)
+            slash = suffix.find(b"/", base)
+            if slash == -1:
+                if len(suffix) > base:
+                    files.append(self.day + suffix.decode("utf-8"))
+                i += 1
+            else:
+                folder = suffix[:slash + 1]
+                folders.append(folder[base:].decode("utf-8"))
+                # Skip the rest of the folder: "0" sorts straight after "/"
+                i = self._lower_bound(folder[:-1] + b"0", i + 1)
+        return folders, files
+
+    def objects(self, prefix: str = None):
+        """Yields (key, size, last_modified_ms, etag) for keys under prefix."""
+        start, stop = self.range(prefix or self.day)
+        for i in range(start, stop):
+            yield self.key(i), self.sizes[i], self.last_modified[i], self.etag(i)
+
+
+def day_partition(prefix: str):
+    """Returns the YYYY/MM/DD/ partition a prefix falls within, or None."""
+    match = DAY_PATTERN.match(prefix or "")
+    return match.group(0) if match else None
+
+
+def finalized_at(day: str):
+    """Returns when a day partition stops changing (SETTLE_HOURS after it ends), or None."""
+    try:
+        day_end = datetime.strptime(day, "%Y/%m/%d/") + timedelta(days=1)
+    except ValueError:
+        return None
+    return day_end + timedelta(hours=SETTLE_HOURS)
+
+
+def is_finalized(day: str) -> bool:
+    finalized = finalized_at(day)
+    return finalized is not None and datetime.now() >= finalized
+
+
+def is_stale(snapshot: ListingSnapshot) -> bool:
+    """Whether a snapshot was built before its day finalized, e.g. after SETTLE_HOURS was raised."""
+    finalized = finalized_at(snapshot.day)
+    return finalized is None or snapshot.built_at < finalized.timestamp()
+
+
+def snapshot_path(bucket: str, day: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, bucket, day.rstrip("/") + ".snap")
+
+
+def write_snapshot(bucket: str, day: str, objects) -> str:
+    """
+    Writes a snapshot from (key, size, LastModified datetime, etag) tuples
+    for keys under day. The file is written to a temp name and renamed into place.
+    """
+    rows = sorted(
+        (key[len(day):].encode("utf-8"), size, int(last_modified.timestamp() * 1000), etag.encode("utf-8"))
+        for key, size, last_modified, etag in objects
+    )
+    suffix_offsets, etag_offsets = [0], [0]
+    for suffix, _, _, etag in rows:
+        suffix_offsets.append(suffix_offsets[-1] + len(suffix))
+        etag_offsets.append(etag_offsets[-1] + len(etag))
+    count = len(rows)
+    offsets, total = _layout(count, suffix_offsets[-1], etag_offsets[-1])
+
+    data = bytearray(total)
+    HEADER.pack_into(data, 0, MAGIC, count, int(datetime.now().timestamp()), suffix_offsets[-1], etag_offsets[-1])
+    struct.pack_into(f"<{count + 1}I", data, offsets["suffix_offsets"], *suffix_offsets)
+    struct.pack_into(f"<{count + 1}I", data, offsets["etag_offsets"], *etag_offsets)
+    struct.pack_into(f"<{count}q", data, offsets["sizes"], *(row[1] for row in rows))
+    struct.pack_into(f"<{count}q", data, offsets["last_modified"], *(row[2] for row in rows))
+    data[offsets["suffixes"]:offsets["suffixes"] + suffix_offsets[-1]] = b"".join(row[0] for row in rows)
+    data[offsets["etags"]:offsets["etags"] + etag_offsets[-1]] = b"".join(row[3] for row in rows)
+
+    path = snapshot_path(bucket, day)
+    private_dir(SNAPSHOT_DIR)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def build_snapshot(s3, bucket: str, day: str) -> str:
+    """Lists a whole day partition and writes its snapshot."""
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=day):
+        for item in page.get("Contents", []):
+            objects.append((item["Key"], item["Size"], item["LastModified"], item.get("ETag", "")))
+    return write_snapshot(bucket, day, objects)
+
+
+def snapshot_for(bucket: str, prefix: str, get_client=None):
+    """
+    Returns the ListingSnapshot covering prefix, or None if prefix isn't within
+    a single day partition. A finalized day without a snapshot is listed once
+    (with get_client()) and snapshotted; days that may still change are never
+    snapshotted, and a snapshot built before its day finalized is rebuilt.
+    """
+    day = day_partition(prefix)
+    if not ENABLED or day is None:
+        return None
+    path = snapshot_path(bucket, day)
+    with _lock:
+        snapshot = _open_snapshots.get(path)
+        if snapshot is not None:
+            return snapshot
+        try:
+            private_dir(SNAPSHOT_DIR)
+        except OSError:
+            return None  # Never trust (or write) snapshots in a directory others can write to
+        try:
+            snapshot = ListingSnapshot(path, day) if os.path.exists(path) else None
+        except (OSError, ValueError):
+            snapshot = None
+        if snapshot is None or is_stale(snapshot):
+            if snapshot is not None:
+                snapshot.close()
+            if get_client is None or not is_finalized(day):
+                return None
+            build_snapshot(get_client(), bucket, day)
+            snapshot = ListingSnapshot(path, day)
+        _open_snapshots[path] = snapshot
+        return snapshot
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: listing_snapshot.py BUCKET [YYYY-MM-DD ...]  (default: yesterday)")
+        sys.exit(1)
+    import boto3
+    from s3_controller import CONTROLLER
+
+    bucket = sys.argv[1]
+    dates = sys.argv[2:] or [(datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")]
+    # Whole-day listings go through the throttle-aware controller like every other S3 path
+    session = boto3.Session(profile_name=os.environ.get("AWS_PROFILE"), region_name=os.environ.get("AWS_REGION"))
+    s3 = CONTROLLER.client(session)
+    for date in dates:
+        day = datetime.strptime(date, "%Y-%m-%d").strftime("%Y/%m/%d/")
+        if not is_finalized(day):
+            print(f"Skipped {day}: not finalized yet")
+            continue
+        path = build_snapshot(s3, bucket, day)
+        print(f"Wrote {path} ({len(ListingSnapshot(path, day))} objects)")
+    CONTROLLER.report()
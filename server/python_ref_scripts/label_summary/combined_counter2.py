@@ -1,9 +1,12 @@
 import boto3
 from datetime import datetime, timedelta
-from math import ceil
 import sys
 import requests # Keeping requests just in case it was used for something else, although not for
 from server import settings # Assuming settings will be managed locally for non-secret vars
+from server.s3_controller import CONTROLLER
+from server.listing_snapshot import snapshot_for
+from label_rules import LABEL_FOLDERS, format_report
+from live_counter import live_report
 
 # SLACK_WEBHOOK_URL and related logic were removed as per user instruction.
 # No hardcoded secrets should be present.
@@ -11,10 +14,15 @@ from server import settings # Assuming settings will be managed locally for non-
 
 def init_s3_client():
     session = boto3.Session(profile_name="gateway")
-    return session.client("s3")
+    return CONTROLLER.client(session)
 
 
 def count_png_files(s3_client, bucket_name, prefix):
+    # Finalized days are counted from their listing snapshot without touching S3
+    snapshot = snapshot_for(bucket_name, prefix, lambda: s3_client)
+    if snapshot is not None:
+        return sum(1 for key, _, _, _ in snapshot.objects(prefix) if key.endswith(".png"))
+
     paginator = s3_client.get_paginator("list_objects_v2")
     operation_parameters = {"Bucket": bucket_name, "Prefix": prefix}
     total_count = 0
@@ -31,22 +39,27 @@ def get_folder_breakdown(s3_client, bucket_name, base_prefix):
     """
     Returns a dict of {subfolder_name: png_count} for the given prefix.
     """
-    paginator = s3_client.get_paginator("list_objects_v2")
-    operation_parameters = {
-        "Bucket": bucket_name,
-        "Prefix": base_prefix,
-        "Delimiter": "/"
-    }
+    snapshot = snapshot_for(bucket_name, base_prefix, lambda: s3_client)
+    if snapshot is not None:
+        prefixes = [base_prefix + folder for folder in snapshot.listing(base_prefix)[0]]
+    else:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        operation_parameters = {
+            "Bucket": bucket_name,
+            "Prefix": base_prefix,
+            "Delimiter": "/"
+        }
 
-    subfolders = []
-    for page in paginator.paginate(**operation_parameters):
-        subfolders.extend(page.get("CommonPrefixes", []))
+        subfolders = []
+        for page in paginator.paginate(**operation_parameters):
+            subfolders.extend(page.get("CommonPrefixes", []))
+
+        prefixes = [folder["Prefix"] for folder in subfolders]
+    counts = CONTROLLER.map(lambda prefix: count_png_files(s3_client, bucket_name, prefix), prefixes)
 
     breakdown = {}
 
-    for folder in subfolders:
-        prefix = folder["Prefix"]
-        count = count_png_files(s3_client, bucket_name, prefix)
+    for prefix, count in zip(prefixes, counts):
         subfolder_name = prefix.replace(base_prefix, "").strip("/")
         breakdown[subfolder_name] = count
 
@@ -66,56 +79,17 @@ def generate_report(date_str=None):
     prefix = f"{selected_date}/"
 
     # Define the folders to check under the date
-    initial_folders = {
-        "Anomaly": f"{prefix}Anomaly/",
-        "CoV": f"{prefix}CoV/",
-        "Manifests": f"{prefix}Manifests/",
-        "NewSales": f"{prefix}NewSales/",
-        "ReplacementCradle": f"{prefix}ReplacementCradle/",
-        "ReplacementChargingCable": f"{prefix}ReplacementChargingCable/",
-        "ReplacementDevice": f"{prefix}ReplacementDevice/",
-        "ReturnQR": f"{prefix}ReturnQR/",
-        "Powerbank": f"{prefix}Powerbank/",
-        "Returns": f"{prefix}Returns/"
-    }
+    initial_folders = {folder: f"{prefix}{folder}/" for folder in LABEL_FOLDERS}
 
     # Count PNGs in all top-level folders
-    counts = {label: count_png_files(s3_client, bucket_name, path) for label, path in initial_folders.items()}
+    folder_counts = CONTROLLER.map(lambda path: count_png_files(s3_client, bucket_name, path), initial_folders.values())
+    counts = dict(zip(initial_folders.keys(), folder_counts))
 
     # Get breakdowns
     newsales_breakdown = get_folder_breakdown(s3_client, bucket_name, initial_folders["NewSales"])
     anomalies_breakdown = get_folder_breakdown(s3_client, bucket_name, initial_folders["Anomaly"])
 
-    # Totals
-    newsales_total = sum(newsales_breakdown.values())
-    anomalies_total = sum(anomalies_breakdown.values())
-
-    # Transform counts into combined categories
-    combined_counts = {
-        "NewSales": newsales_total,
-        "ReplacementCradles": counts["CoV"] + counts["ReplacementCradle"],
-        "Returns": ceil(counts["Returns"] / 2),
-        "Anomalies": ceil(anomalies_total / 2),
-        "API": counts["ReplacementDevice"],
-        "Powerbank": counts["Powerbank"],
-        "ReplacementChargingCable": counts["ReplacementChargingCable"]
-    }
-
-    # Format output
-    output_lines = [f"Label Summary for {selected_date}:", "-" * 30]
-    for label, count in combined_counts.items():
-        output_lines.append(f"{label:<25}: {count}")
-
-        # Detailed breakdowns
-        if label == "NewSales":
-            for subfolder, subcount in sorted(newsales_breakdown.items()):
-                output_lines.append(f"  - {subfolder:<22}: {subcount}")
-
-        elif label == "Anomalies":
-            for subfolder, subcount in sorted(anomalies_breakdown.items()):
-                output_lines.append(f"  - {subfolder:<22}: {ceil(subcount / 2)}")
-
-    output_text = "\n".join(output_lines)
+    output_text = format_report(selected_date, counts, newsales_breakdown, anomalies_breakdown)
 
     return output_text
 
@@ -130,7 +104,9 @@ if __name__ == "__main__":
         except (ValueError, IndexError):
             pass  # No date provided, will use current date
 
-        report = generate_report(date_str=date_arg)
+        # Served from the live counters when a consumer is keeping them current
+        report = live_report(date_str=date_arg) or generate_report(date_str=date_arg)
         print(report)
+        CONTROLLER.report()
     else:
         print("This script is intended to be run with the --screen argument.")
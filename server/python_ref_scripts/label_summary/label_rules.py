@@ -0,0 +1,73 @@
+from math import ceil
+
+# Top-level label folders under each YYYY/MM/DD/ partition, in report order
+LABEL_FOLDERS = (
+    "Anomaly",
+    "CoV",
+    "Manifests",
+    "NewSales",
+    "ReplacementCradle",
+    "ReplacementChargingCable",
+    "ReplacementDevice",
+    "ReturnQR",
+    "Powerbank",
+    "Returns",
+)
+
+# Folders whose report line is broken down per subfolder
+BREAKDOWN_FOLDERS = ("NewSales", "Anomaly")
+
+
+def classify_key(key):
+    """
+    Returns (date_prefix, folder, subfolder) for a label PNG key, or None if the
+    key would not be counted by generate_report. subfolder is None for PNGs
+    sitting directly in the top-level folder.
+    """
+    if not key.endswith(".png"):
+        return None
+    parts = key.split("/")
+    if len(parts) < 5 or not all(p.isdigit() for p in parts[:3]):
+        return None
+    folder = parts[3]
+    if folder not in LABEL_FOLDERS:
+        return None
+    subfolder = parts[4] if len(parts) > 5 else None
+    return "/".join(parts[:3]), folder, subfolder
+
+
+def combine_counts(counts, newsales_breakdown, anomalies_breakdown):
+    """
+    Transforms raw per-folder PNG counts into the combined report categories.
+    """
+    newsales_total = sum(newsales_breakdown.values())
+    anomalies_total = sum(anomalies_breakdown.values())
+
+    return {
+        "NewSales": newsales_total,
+        "ReplacementCradles": counts["CoV"] + counts["ReplacementCradle"],
+        "Returns": ceil(counts["Returns"] / 2),
+        "Anomalies": ceil(anomalies_total / 2),
+        "API": counts["ReplacementDevice"],
+        "Powerbank": counts["Powerbank"],
+        "ReplacementChargingCable": counts["ReplacementChargingCable"]
+    }
+
+
+def format_report(selected_date, counts, newsales_breakdown, anomalies_breakdown):
+    combined_counts = combine_counts(counts, newsales_breakdown, anomalies_breakdown)
+
+    output_lines = [f"Label Summary for {selected_date}:", "-" * 30]
+    for label, count in combined_counts.items():
+        output_lines.append(f"{label:<25}: {count}")
+
+        # Detailed breakdowns
+        if label == "NewSales":
+            for subfolder, subcount in sorted(newsales_breakdown.items()):
+                output_lines.append(f"  - {subfolder:<22}: {subcount}")
+
+        elif label == "Anomalies":
+            for subfolder, subcount in sorted(anomalies_breakdown.items()):
+                output_lines.append(f"  - {subfolder:<22}: {ceil(subcount / 2)}")
+
+    return "\n".join(output_lines)
@@ -0,0 +1,321 @@
+import boto3
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from urllib.parse import unquote_plus
+from server.s3_controller import CONTROLLER
+from label_rules import LABEL_FOLDERS, BREAKDOWN_FOLDERS, classify_key, format_report
+
+BUCKET_NAME = "pat-labels"
+DB_FILE = os.environ.get("LABEL_COUNTS_DB", "./label_counts.sqlite")
+RECONCILE_SECONDS = int(os.environ.get("LABEL_RECONCILE_SECONDS", "900"))
+# Counters are only trusted while the consumer has checked in recently
+MAX_AGE_SECONDS = int(os.environ.get("LABEL_LIVE_MAX_AGE", "300"))
+
+
+class LabelCountStore:
+    """
+    SQLite-backed PNG counters per (date, folder, subfolder).
+
+    Every counted key is tracked with the sequencer of its latest event so that
+    duplicate or out-of-order notifications don't skew the counters. Rows with
+    an empty subfolder hold the folder totals.
+    """
+
+    def __init__(self, path: str = DB_FILE):
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                key TEXT PRIMARY KEY,
+                day TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                subfolder TEXT NOT NULL,
+                present INTEGER NOT NULL,
+                sequencer TEXT NOT NULL DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS objects_day ON objects (day);
+            CREATE TABLE IF NOT EXISTS counts (
+                day TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                subfolder TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (day, folder, subfolder)
+            );
+            CREATE TABLE IF NOT EXISTS days (
+                day TEXT PRIMARY KEY,
+                reconciled_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS state (
+                name TEXT PRIMARY KEY,
+                value REAL
+            );
+        """)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def _bump(self, day, folder, subfolder, delta):
+        rows = [(day, folder, "")]
+        if subfolder:
+            rows.append((day, folder, subfolder))
+        for row in rows:
+            self.db.execute(
+                "INSERT INTO counts (day, folder, subfolder, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (day, folder, subfolder) DO UPDATE SET count = count + excluded.count",
+                (*row, delta),
+            )
+
+    def apply(self, key: str, created: bool, sequencer: str = "") -> bool:
+        """
+        Applies one ObjectCreated/ObjectRemoved event. Returns True if the
+        counters changed. Call commit() once the batch is done.
+        """
+        info = classify_key(key)
+        if info is None:
+            return False
+        day, folder, subfolder = info
+        subfolder = subfolder or ""
+        self.db.execute("INSERT OR IGNORE INTO days (day, reconciled_at) VALUES (?, NULL)", (day,))
+
+        row = self.db.execute("SELECT present, sequencer FROM objects WHERE key = ?", (key,)).fetchone()
+        if row and sequencer and row[1] and _sequencer_key(sequencer) <= _sequencer_key(row[1]):
+            return False  # Stale or duplicate delivery
+        was_present = bool(row and row[0])
+
+        self.db.execute(
+            "INSERT INTO objects (key, day, folder, subfolder, present, sequencer) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET present = excluded.present, sequencer = excluded.sequencer",
+            (key, day, folder, subfolder, int(created), sequencer),
+        )
+        if created == was_present:
+            return False  # Overwrite of an existing label, or delete of one we never counted
+        self._bump(day, folder, subfolder, 1 if created else -1)
+        return True
+
+    def commit(self):
+        self.db.execute("INSERT OR REPLACE INTO state (name, value) VALUES ('heartbeat', ?)", (time.time(),))
+        self.db.commit()
+
+    def reconcile(self, s3_client, bucket_name: str, day: str) -> int:
+        """
+        Re-lists a date partition and makes the tracked keys match it exactly.
+        Subfolders of the breakdown folders are recorded even when they hold no
+        PNGs, as the scan lists them. Returns the number of keys whose state was
+        corrected.
+        """
+        listed = set()
+        subfolders = set()
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{day}/"):
+            for obj in page.get("Contents", []):
+                if classify_key(obj["Key"]) is not None:
+                    listed.add(obj["Key"])
+                # Any key below FOLDER/SUBFOLDER/ makes SUBFOLDER a common prefix in the scan's listing
+                parts = obj["Key"][len(day) + 1:].split("/")
+                if len(parts) > 2 and parts[0] in BREAKDOWN_FOLDERS and parts[1]:
+                    subfolders.add((parts[0], parts[1]))
+
+        tracked = {
+            key: bool(present)
+            for key, present in self.db.execute("SELECT key, present FROM objects WHERE day = ?", (day,))
+        }
+        corrections = 0
+        for key in listed:
+            if not tracked.get(key):
+                _, folder, subfolder = classify_key(key)
+                self.db.execute(
+                    "INSERT INTO objects (key, day, folder, subfolder, present) VALUES (?, ?, ?, ?, 1) "
+                    "ON CONFLICT (key) DO UPDATE SET present = 1",
+                    (key, day, folder, subfolder or ""),
+                )
+                corrections += 1
+        for key, present in tracked.items():
+            if present and key not in listed:
+                self.db.execute("UPDATE objects SET present = 0 WHERE key = ?", (key,))
+                corrections += 1
+
+        # Rebuild the day's counters from the corrected key set
+        self.db.execute("DELETE FROM counts WHERE day = ?", (day,))
+        self.db.execute(
+            "INSERT INTO counts (day, folder, subfolder, count) "
+            "SELECT day, folder, '', COUNT(*) FROM objects WHERE day = ? AND present = 1 GROUP BY folder",
+            (day,),
+        )
+        self.db.execute(
+            "INSERT INTO counts (day, folder, subfolder, count) "
+            "SELECT day, folder, subfolder, COUNT(*) FROM objects "
+            "WHERE day = ? AND present = 1 AND subfolder != '' GROUP BY folder, subfolder",
+            (day,),
+        )
+        self.db.executemany(
+            "INSERT OR IGNORE INTO counts (day, folder, subfolder, count) VALUES (?, ?, ?, 0)",
+            [(day, folder, subfolder) for folder, subfolder in subfolders],
+        )
+        self.db.execute("INSERT OR REPLACE INTO days (day, reconciled_at) VALUES (?, ?)", (day, time.time()))
+        self.commit()
+        return corrections
+
+    def unreconciled_days(self):
+        return [row[0] for row in self.db.execute("SELECT day FROM days WHERE reconciled_at IS NULL")]
+
+    def summary(self, day: str):
+        """
+        Returns (counts, newsales_breakdown, anomalies_breakdown) for a reconciled
+        day, or None if the day has no trusted baseline or the consumer is stale.
+        """
+        heartbeat = self.db.execute("SELECT value FROM state WHERE name = 'heartbeat'").fetchone()
+        if not heartbeat or time.time() - heartbeat[0] > MAX_AGE_SECONDS:
+            return None
+        reconciled = self.db.execute("SELECT reconciled_at FROM days WHERE day = ?", (day,)).fetchone()
+        if not reconciled or reconciled[0] is None:
+            return None
+
+        counts = {folder: 0 for folder in LABEL_FOLDERS}
+        breakdowns = {folder: {} for folder in BREAKDOWN_FOLDERS}
+        for folder, subfolder, count in self.db.execute(
+            "SELECT folder, subfolder, count FROM counts WHERE day = ?", (day,)
+        ):
+            if not subfolder:
+                counts[folder] = count
+            elif folder in breakdowns:
+                breakdowns[folder][subfolder] = count
+        return counts, breakdowns["NewSales"], breakdowns["Anomaly"]
+
+
+def _sequencer_key(sequencer: str):
+    # Sequencers are hex strings of varying length; compare them as numbers
+    return int(sequencer, 16) if sequencer else -1
+
+
+def parse_records(body):
+    """
+    Yields (bucket, key, created, sequencer) from an S3 notification payload.
+    Accepts raw S3 events as well as SNS-wrapped ones, and skips s3:TestEvent.
+    """
+    message = json.loads(body) if isinstance(body, str) else body
+    if "Message" in message and "Records" not in message:
+        message = json.loads(message["Message"])
+    for record in message.get("Records", []):
+        event_name = record.get("eventName", "")
+        if event_name.startswith("ObjectCreated"):
+            created = True
+        elif event_name.startswith("ObjectRemoved"):
+            created = False
+        else:
+            continue
+        s3_info = record.get("s3", {})
+        bucket = s3_info.get("bucket", {}).get("name")
+        obj = s3_info.get("object", {})
+        # Keys in notifications are URL-encoded with '+' for spaces
+        key = unquote_plus(obj.get("key", ""))
+        yield bucket, key, created, obj.get("sequencer", "")
+
+
+def apply_payload(store, body, bucket_name=BUCKET_NAME):
+    changed = 0
+    for bucket, key, created, sequencer in parse_records(body):
+        if bucket == bucket_name and store.apply(key, created, sequencer):
+            changed += 1
+    return changed
+
+
+def init_s3_session():
+    return boto3.Session(profile_name=os.environ.get("AWS_PROFILE", "gateway"),
+                         region_name=os.environ.get("AWS_REGION"))
+
+
+def reconcile_days(store, s3_client, days):
+    for day in sorted(set(days)):
+        corrections = store.reconcile(s3_client, BUCKET_NAME, day)
+        print(f"Reconciled {day}: {corrections} correction(s)")
+
+
+def consume_file(store, path):
+    """
+    Local stand-in for the queue: one notification payload per line.
+    """
+    changed = 0
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                changed += apply_payload(store, line)
+    store.commit()
+    print(f"Applied {changed} counter change(s) from {path}")
+
+
+def consume_sqs(store, queue_url):
+    session = init_s3_session()
+    sqs = session.client("sqs")
+    s3_client = CONTROLLER.client(session)
+    today = datetime.now().strftime("%Y/%m/%d")
+    reconcile_days(store, s3_client, [today])
+    last_reconcile = time.monotonic()
+
+    while True:
+        response = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=20)
+        messages = response.get("Messages", [])
+        for message in messages:
+            apply_payload(store, message["Body"])
+        store.commit()
+        if messages:
+            sqs.delete_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]} for i, m in enumerate(messages)],
+            )
+
+        # New days get a baseline straight away. Only today and yesterday still receive
+        # labels, so only they are re-listed periodically to fix drift; selecting on
+        # reconciled_at would keep every day ever reconciled in the set forever
+        days = store.unreconciled_days()
+        if time.monotonic() - last_reconcile >= RECONCILE_SECONDS:
+            now = datetime.now()
+            days += [now.strftime("%Y/%m/%d"), (now - timedelta(days=1)).strftime("%Y/%m/%d")]
+            last_reconcile = time.monotonic()
+        if days:
+            reconcile_days(store, s3_client, days)
+
+
+def live_report(date_str=None):
+    """
+    Returns the label summary text from the live counters, or None if they
+    can't be trusted for this date (no consumer running, no baseline yet).
+    """
+    if not os.path.exists(DB_FILE):
+        return None
+    target_date = datetime.strptime(date_str, "%Y-%m-%d") if date_str else datetime.now()
+    selected_date = target_date.strftime("%Y/%m/%d")
+    store = LabelCountStore()
+    try:
+        summary = store.summary(selected_date)
+    finally:
+        store.close()
+    if summary is None:
+        return None
+    counts, newsales_breakdown, anomalies_breakdown = summary
+    return format_report(selected_date, counts, newsales_breakdown, anomalies_breakdown)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    store = LabelCountStore()
+    try:
+        if command == "sqs":
+            consume_sqs(store, sys.argv[2])
+        elif command == "file":
+            consume_file(store, sys.argv[2])
+        elif command == "reconcile":
+            dates = [datetime.strptime(d, "%Y-%m-%d").strftime("%Y/%m/%d") for d in sys.argv[2:]]
+            reconcile_days(store, CONTROLLER.client(init_s3_session()), dates or [datetime.now().strftime("%Y/%m/%d")])
+        elif command == "--screen":
+            date_arg = sys.argv[2] if len(sys.argv) > 2 else None
+            print(live_report(date_str=date_arg) or "No live counts for this date.")
+        else:
+            print("Usage: live_counter.py sqs QUEUE_URL | file EVENTS.jsonl | reconcile [YYYY-MM-DD ...] | --screen [YYYY-MM-DD]")
+            sys.exit(1)
+    finally:
+        store.close()
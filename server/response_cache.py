@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from cache_paths import CACHE_ROOT, private_dir, owned_file
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; fall back to caching without single-flight
+    fcntl = None
+
+CACHE_DIR = os.environ.get("S3_RESPONSE_CACHE_DIR", os.path.join(CACHE_ROOT, "responses"))
+ENABLED = os.environ.get("S3_RESPONSE_CACHE", "1") != "0"
+LIST_TTL = float(os.environ.get("S3_LIST_CACHE_TTL", "30"))
+SEARCH_TTL = float(os.environ.get("S3_SEARCH_CACHE_TTL", "30"))
+# Searches that found nothing are cached too, but for less time since a label may be about to land
+NEGATIVE_TTL = float(os.environ.get("S3_NEGATIVE_CACHE_TTL", "10"))
+# Expired entries and their lock files are swept at most this often, by whichever process writes
+SWEEP_INTERVAL = float(os.environ.get("S3_RESPONSE_CACHE_SWEEP", "300"))
+SWEEP_MARKER = ".last-sweep"
+
+
+def _cache_path(command: str, parts) -> str:
+    digest = hashlib.sha256(json.dumps([command, *parts]).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{command}-{digest}")
+
+
+def _read_fresh(path: str):
+    """Returns (hit, value) for an unexpired entry."""
+    try:
+        with open(path + ".json") as f:
+            if not owned_file(f):
+                return False, None
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return False, None
+    if time.time() - entry["created"] > entry["ttl"]:
+        return False, None
+    return True, entry["value"]
+
+
+def _sweep():
+    """
+    Removes expired entries, their lock files and leftover temp files, so
+    distinct keys (search terms are free text) don't accumulate forever.
+    """
+    marker = os.path.join(CACHE_DIR, SWEEP_MARKER)
+    now = time.time()
+    try:
+        if now - os.stat(marker).st_mtime < SWEEP_INTERVAL:
+            return
+    except FileNotFoundError:
+        pass
+    with open(marker, "a"):
+        os.utime(marker)
+
+    with os.scandir(CACHE_DIR) as it:
+        names = [entry.name for entry in it]
+    for name in names:
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            if name.endswith(".json"):
+                if not _read_fresh(path[:-len(".json")])[0]:
+                    os.remove(path)
+            elif name.endswith(".tmp") and now - os.stat(path).st_mtime > SWEEP_INTERVAL:
+                os.remove(path)
+        except OSError:
+            pass
+    for name in names:
+        if not name.endswith(".lock") or os.path.exists(os.path.join(CACHE_DIR, name[:-len(".lock")] + ".json")):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            with open(path, "a") as lock:
+                # Skip keys that are being computed right now
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _write(path: str, value, ttl: float):
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"created": time.time(), "ttl": ttl, "value": value}, f)
+    os.replace(tmp_path, path + ".json")
+
+
+def cached_response(command: str, parts, ttl: float, compute, negative_ttl: float = None):
+    """
+    Returns compute() through a short-lived on-disk cache shared by every
+    process. Concurrent misses for the same key are single-flighted on a lock
+    file: one process runs compute() while the rest wait and read its result.
+    A None result is cached for negative_ttl if given; exceptions are never cached.
+    """
+    if not ENABLED:
+        return compute()
+    try:
+        private_dir(CACHE_DIR)
+    except OSError:
+        return compute()
+
+    path = _cache_path(command, parts)
+    hit, value = _read_fresh(path)
+    if hit:
+        return value
+
+    with open(path + ".lock", "a") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        # Whoever held the lock may have just filled the entry
+        hit, value = _read_fresh(path)
+        if hit:
+            return value
+        value = compute()
+        entry_ttl = ttl if value is not None else negative_ttl
+        if entry_ttl:
+            try:
+                _write(path, value, entry_ttl)
+            except OSError:
+                pass  # Caching is best-effort
+    try:
+        _sweep()
+    except OSError:
+        pass
+    return value
@@ -0,0 +1,348 @@
+import os
+import sys
+import json
+import time
+import marshal
+import hashlib
+import tempfile
+import threading
+import botocore
+import botocore.loaders
+from botocore.config import Config
+
+# Imported both as a top-level module (scripts in server/) and as server.s3_controller
+if __package__:
+    from .cache_paths import CACHE_ROOT, private_dir, owned_file
+else:
+    from cache_paths import CACHE_ROOT, private_dir, owned_file
+
+# Error codes S3 (and the generic AWS retry handler) use to tell us to back off.
+THROTTLE_CODES = {
+    "SlowDown",
+    "503 Slow Down",
+    "ServiceUnavailable",
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "TooManyRequestsException",
+}
+THROTTLE_STATUS = {429, 503}
+
+INITIAL_LIMIT = int(os.environ.get("S3_INITIAL_CONCURRENCY", "8"))
+MAX_LIMIT = int(os.environ.get("S3_MAX_CONCURRENCY", "64"))
+MAX_ATTEMPTS = int(os.environ.get("S3_MAX_ATTEMPTS", "10"))
+LATENCY_TARGET = float(os.environ.get("S3_LATENCY_TARGET", "1.5"))  # seconds per call
+MODEL_CACHE_DIR = os.environ.get("S3_MODEL_CACHE_DIR", os.path.join(CACHE_ROOT, "botocore"))
+# Set by jobs.py: listing progress is written here so a job's status can report it
+PROGRESS_FILE = os.environ.get("S3_PROGRESS_FILE")
+PROGRESS_INTERVAL = 0.5  # seconds between progress file writes
+LISTING_OPERATIONS = {"ListObjectsV2", "ListObjects"}
+
+
+def _plain(value):
+    # marshal only handles plain containers, not the OrderedDicts botocore parses into
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_plain(v) for v in value)
+    return value
+
+
+class CachedLoader(botocore.loaders.Loader):
+    """
+    botocore data loader that keeps the data files it parses (endpoints, the
+    S3 service model and endpoint rules) and its data directory scans in
+    MODEL_CACHE_DIR, so new processes skip re-parsing gzipped JSON.
+
+    Entries are marshal files (which can't run code when loaded) in a private
+    per-user directory, keyed on the botocore version and on the contents of
+    any other search paths such as ~/.aws/models, so custom models still win.
+    """
+
+    _fingerprint = None
+
+    def _search_path_fingerprint(self) -> str:
+        if self._fingerprint is None:
+            entries = []
+            for search_path in self.search_paths:
+                if search_path == self.BUILTIN_DATA_PATH:
+                    continue  # Covered by the botocore version
+                for root, dirs, files in os.walk(search_path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        try:
+                            st = os.stat(os.path.join(root, name))
+                        except OSError:
+                            continue
+                        entries.append((os.path.join(root, name), st.st_size, st.st_mtime_ns))
+            self._fingerprint = hashlib.sha256(json.dumps([botocore.__version__, entries]).encode("utf-8")).hexdigest()[:16]
+        return self._fingerprint
+
+    def _cached(self, method_name: str, compute, *args):
+        try:
+            cache_dir = private_dir(MODEL_CACHE_DIR)
+        except OSError:
+            return compute(*args)
+        name = "__".join([method_name, *args]).replace("/", "__")
+        path = os.path.join(cache_dir, f"{name}.{self._search_path_fingerprint()}.marshal")
+        try:
+            with open(path, "rb") as f:
+                if owned_file(f):
+                    # loads() on the whole file is several times faster than load() on the stream
+                    return marshal.loads(f.read())
+        except (OSError, ValueError, EOFError, TypeError):
+            pass
+        result = compute(*args)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(marshal.dumps(_plain(result)))
+            os.replace(tmp_path, path)
+        except (OSError, ValueError):
+            pass  # Caching is best-effort
+        return result
+
+    @botocore.loaders.instance_cache
+    def load_data_with_path(self, name):
+        return self._cached("load_data_with_path", super().load_data_with_path, name)
+
+    @botocore.loaders.instance_cache
+    def list_available_services(self, type_name):
+        return self._cached("list_available_services", super().list_available_services, type_name)
+
+    @botocore.loaders.instance_cache
+    def determine_latest_version(self, service_name, type_name):
+        return self._cached("determine_latest_version", super().determine_latest_version, service_name, type_name)
+
+
+def use_model_cache(session):
+    """Swaps a session's data loader for a CachedLoader with the same search paths."""
+    core = getattr(session, "_session", session)  # boto3 sessions wrap a botocore session
+    loader = core.get_component("data_loader")
+    if not isinstance(loader, CachedLoader):
+        core.register_component("data_loader", CachedLoader(
+            extra_search_paths=list(loader.search_paths),
+            include_default_search_paths=False,
+        ))
+
+
+class BucketLimiter:
+    """
+    AIMD limit on in-flight requests for a single bucket.
+
+    Every clean, fast response grows the limit by roughly one slot per window;
+    a throttle halves it and a slow response trims it by 10%. Decreases are
+    spaced at least one latency target apart so a burst of SlowDowns from the
+    same window only counts once.
+    """
+
+    def __init__(self, initial: int = INITIAL_LIMIT, minimum: int = 1, maximum: int = MAX_LIMIT,
+                 latency_target: float = LATENCY_TARGET):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttles = 0
+        self.decreases = 0
+        self.total_latency = 0.0
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self):
+        with self.cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.cond.notify_all()
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        if now - self.last_decrease < self.latency_target:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * factor)
+        self.decreases += 1
+
+    def on_throttle(self):
+        with self.cond:
+            self.throttles += 1
+            self._decrease(0.5)
+
+    def on_complete(self, latency: float, ok: bool, retried: bool = False):
+        with self.cond:
+            self.requests += 1
+            self.total_latency += latency
+            if not ok:
+                self.errors += 1
+            elif retried:
+                pass  # Latency includes retry backoff; the throttles already adjusted the limit
+            elif latency > self.latency_target:
+                self._decrease(0.9)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            return {
+                "limit": int(self.limit),
+                "inFlight": self.in_flight,
+                "peakInFlight": self.peak_in_flight,
+                "requests": self.requests,
+                "errors": self.errors,
+                "throttles": self.throttles,
+                "decreases": self.decreases,
+                "avgLatencyMs": round(1000 * self.total_latency / self.requests, 1) if self.requests else None,
+            }
+
+
+class S3Controller:
+    """
+    Process-wide throttle-aware controller shared by every S3-calling path.
+
+    Clients created through ``client()`` use botocore's adaptive retry mode and
+    have their calls (including paginator pages) gated by a per-bucket
+    ``BucketLimiter`` via botocore's event hooks.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.pages_listed = 0
+        self.keys_scanned = 0
+        self.progress_written = 0.0
+
+    def limiter(self, bucket: str) -> BucketLimiter:
+        with self.lock:
+            if bucket not in self.buckets:
+                self.buckets[bucket] = BucketLimiter()
+            return self.buckets[bucket]
+
+    def config(self) -> Config:
+        return Config(
+            retries={"mode": "adaptive", "max_attempts": MAX_ATTEMPTS},
+            max_pool_connections=MAX_LIMIT,
+        )
+
+    def client(self, session, region_name: str = None):
+        use_model_cache(session)
+        # boto3 sessions have client(); bare botocore sessions (cheaper to import) have create_client()
+        create = getattr(session, "create_client", None) or session.client
+        return self.attach(create("s3", region_name=region_name or None, config=self.config()))
+
+    def attach(self, s3):
+        events = s3.meta.events
+        events.register("before-parameter-build.s3", self._on_params)
+        events.register("before-call.s3", self._on_before_call)
+        events.register("response-received.s3", self._on_response)
+        events.register("after-call.s3", self._on_after_call)
+        events.register("after-call-error.s3", self._on_after_call_error)
+        return s3
+
+    # ========== botocore event handlers ==========
+
+    def _on_params(self, params, context, **kwargs):
+        bucket = params.get("Bucket")
+        if bucket:
+            context["s3ctl_bucket"] = bucket
+
+    def _on_before_call(self, context, **kwargs):
+        bucket = context.get("s3ctl_bucket")
+        if bucket:
+            self.limiter(bucket).acquire()
+            context["s3ctl_start"] = time.monotonic()
+
+    def _on_response(self, response_dict, parsed_response, context, exception, **kwargs):
+        bucket = context.get("s3ctl_bucket")
+        if not bucket:
+            return
+        status = (response_dict or {}).get("status_code")
+        code = ((parsed_response or {}).get("Error") or {}).get("Code")
+        if status in THROTTLE_STATUS or code in THROTTLE_CODES:
+            self.limiter(bucket).on_throttle()
+
+    def _finish(self, context, ok: bool, retried: bool = False):
+        bucket = context.get("s3ctl_bucket")
+        start = context.pop("s3ctl_start", None)
+        if not bucket or start is None:
+            return
+        limiter = self.limiter(bucket)
+        limiter.on_complete(time.monotonic() - start, ok, retried)
+        limiter.release()
+
+    def _on_after_call(self, http_response, parsed, context, model=None, **kwargs):
+        retried = bool((parsed or {}).get("ResponseMetadata", {}).get("RetryAttempts"))
+        self._finish(context, http_response.status_code < 300, retried)
+        if model is not None and model.name in LISTING_OPERATIONS and http_response.status_code < 300:
+            self._on_listing_page(len(parsed.get("Contents", [])) + len(parsed.get("CommonPrefixes", [])))
+
+    def _on_after_call_error(self, context, **kwargs):
+        self._finish(context, False)
+
+    def _on_listing_page(self, keys: int):
+        with self.lock:
+            self.pages_listed += 1
+            self.keys_scanned += keys
+        self.write_progress()
+
+    # ========== Fan-out / instrumentation ==========
+
+    def progress(self) -> dict:
+        with self.lock:
+            return {"pagesListed": self.pages_listed, "keysScanned": self.keys_scanned}
+
+    def write_progress(self, force: bool = False):
+        """Write listing progress to S3_PROGRESS_FILE, at most every PROGRESS_INTERVAL."""
+        if not PROGRESS_FILE:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.progress_written < PROGRESS_INTERVAL:
+                return
+            self.progress_written = now
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(PROGRESS_FILE) or ".", suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.progress(), f)
+            os.replace(tmp_path, PROGRESS_FILE)
+        except OSError:
+            pass  # Progress is best-effort
+
+    def map(self, fn, items, max_workers: int = None):
+        """
+        Run ``fn`` over ``items`` on a thread pool, returning results in order.
+        The pool only caps threads; actual S3 concurrency is set by the limiters.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        items = list(items)
+        if not items:
+            return []
+        workers = max(1, min(max_workers or MAX_LIMIT, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(fn, items))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            buckets = dict(self.buckets)
+        return {name: limiter.snapshot() for name, limiter in sorted(buckets.items())}
+
+    def report(self, stream=None):
+        """Write per-bucket limits and counters to stderr when S3_STATS is set."""
+        self.write_progress(force=True)
+        if not os.environ.get("S3_STATS"):
+            return
+        print(json.dumps({"s3Controller": self.snapshot()}), file=stream or sys.stderr)
+
+
+CONTROLLER = S3Controller()
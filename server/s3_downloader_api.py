@@ -1,22 +1,52 @@
-import boto3
 import json
 import os
 import sys
 import base64
+import importlib
 import io
+import hashlib
+import tempfile
+import struct
 from botocore.exceptions import BotoCoreError, ClientError
-from PIL import Image
+from s3_controller import CONTROLLER
+from listing_snapshot import snapshot_for
+from decoding import PNG_SIGNATURE, decode_label_bytes
+from cache_paths import CACHE_ROOT, private_dir, owned_file
+
+# Node spawns this script per request, so every command is a cold start. Heavy
+# modules are only imported by the commands that use them; see coldstart_check.py.
+COMMAND_IMPORTS = {
+    "list": ("response_cache",),
+    "search": ("response_cache",),
+    "get_image": ("PIL.Image",),
+    "probe": (),
+    "export": ("zipfile", "concurrent.futures"),
+}
+
+EXPORT_WORKERS = int(os.environ.get("S3_EXPORT_WORKERS", "16"))
+# Enough for the IHDR chunk even behind a data: URL prefix and base64 expansion
+PROBE_BYTES = int(os.environ.get("S3_PROBE_BYTES", "256"))
+PNG_COLOR_TYPES = {0: "grayscale", 2: "rgb", 3: "palette", 4: "grayscale+alpha", 6: "rgba"}
+IMAGE_ENCODINGS = ("png", "png-optimized", "png-palette", "png-1bit", "webp", "auto")
+IMAGE_EFFORT = int(os.environ.get("S3_IMAGE_EFFORT", "6"))  # 0 (fastest) to 9 (smallest)
+IMAGE_CACHE_DIR = os.environ.get("S3_IMAGE_CACHE_DIR", os.path.join(CACHE_ROOT, "images"))
+IMAGE_CACHE_VERSION = "2"
+# Least recently served entries are evicted once the cache grows past this
+IMAGE_CACHE_MAX_BYTES = int(float(os.environ.get("S3_IMAGE_CACHE_MAX_MB", "256")) * 1024 * 1024)
 
 def human_error(e: Exception) -> str:
     return f"{type(e).__name__}: {str(e) or 'No details'}"
 
+def preload_command(command: str):
+    for module in COMMAND_IMPORTS.get(command, ()):
+        importlib.import_module(module)
+
 def get_s3_client(profile_name: str = None, region_name: str = None):
     try:
-        if profile_name:
-            session = boto3.Session(profile_name=profile_name, region_name=region_name)
-        else:
-            session = boto3.Session(region_name=region_name)
-        s3 = session.client("s3")
+        # A bare botocore session skips importing boto3 and s3transfer, which we never use here
+        import botocore.session
+        session = botocore.session.Session(profile=profile_name or None)
+        s3 = CONTROLLER.client(session, region_name)
         # Test connection by listing buckets, but gracefully handle the error.
         s3.list_buckets()
         return s3
@@ -34,6 +64,12 @@ def get_s3_client(profile_name: str = None, region_name: str = None):
 
 def list_s3_contents(bucket: str, prefix: str = "", profile: str = None, region: str = None):
     try:
+        # Finalized days are answered from their snapshot without touching S3
+        snapshot = snapshot_for(bucket, prefix, lambda: get_s3_client(profile, region))
+        if snapshot is not None:
+            folders, files = snapshot.listing(prefix)
+            return {"folders": folders, "files": files}
+
         s3 = get_s3_client(profile, region)
         folders = set()
         files = []
@@ -62,6 +98,15 @@ def list_s3_contents(bucket: str, prefix: str = "", profile: str = None, region:
 
 def search_s3_newest_first(bucket: str, prefix: str, term: str, profile: str = None, region: str = None):
     try:
+        snapshot = snapshot_for(bucket, prefix, lambda: get_s3_client(profile, region))
+        if snapshot is not None:
+            newest = None
+            for key, _, last_modified, _ in snapshot.objects(prefix):
+                if key.lower().endswith(".png") and term.lower() in key.lower():
+                    if newest is None or last_modified > newest[1]:
+                        newest = (key, last_modified)
+            return {"key": newest[0]} if newest else None
+
         s3 = get_s3_client(profile, region)
         paginator = s3.get_paginator("list_objects_v2")
 
@@ -88,43 +133,146 @@ def search_s3_newest_first(bucket: str, prefix: str, term: str, profile: str = N
     except Exception as e:
         raise ValueError(f"An unexpected error occurred while searching S3: {human_error(e)}")
 
-def get_s3_image_data(bucket: str, key: str, profile: str = None, region: str = None):
+def flatten_to_white(image):
+    """Drops any alpha channel onto a white background, as the labels print."""
+    from PIL import Image
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        return Image.alpha_composite(Image.new("RGBA", image.size, "white"), image).convert("RGB")
+    return image
+
+def is_monochrome(image) -> bool:
+    colors = image.convert("L").getcolors(2)
+    return colors is not None and all(value in (0, 255) for _, value in colors)
+
+def encode_image(image, encoding: str, effort: int):
+    """
+    Returns (mime_type, bytes, encoding) for the image in the requested transfer
+    encoding, with "auto" resolved to the encoding it picked. effort runs from
+    0 (fastest) to 9 (smallest output).
+    """
+    from PIL import Image
+    if encoding == "auto":
+        encoding = "png-1bit" if is_monochrome(flatten_to_white(image)) else "webp"
+    # zlib level 0 stores the image uncompressed, hundreds of times larger than plain png
+    level = max(1, effort)
+
+    buffered = io.BytesIO()
+    if encoding == "png":
+        image.save(buffered, format="PNG")
+    elif encoding == "png-optimized":
+        image.save(buffered, format="PNG", compress_level=level, optimize=effort >= 9)
+    elif encoding == "png-palette":
+        image = flatten_to_white(image).convert("RGB")
+        # Size the palette to the image so few-colour labels get a 1/2/4-bit PNG
+        colors = image.getcolors(256)
+        image = image.quantize(colors=len(colors) if colors else 256, method=Image.Quantize.FASTOCTREE)
+        image.save(buffered, format="PNG", compress_level=level, optimize=effort >= 9)
+    elif encoding == "png-1bit":
+        image = flatten_to_white(image).convert("L").point(lambda v: 255 if v >= 128 else 0).convert("1")
+        image.save(buffered, format="PNG", compress_level=level, optimize=effort >= 9)
+    elif encoding == "webp":
+        image.save(buffered, format="WEBP", lossless=True, quality=round(effort * 100 / 9), method=round(effort * 6 / 9))
+        return "image/webp", buffered.getvalue(), encoding
+    else:
+        raise ValueError(f"Unknown image encoding '{encoding}', expected one of {', '.join(IMAGE_ENCODINGS)}")
+    return "image/png", buffered.getvalue(), encoding
+
+def _image_cache_path(bucket: str, key: str, encoding: str, effort: int) -> str:
+    # One entry per requested rendition; it records the ETag it was encoded from. Bump
+    # IMAGE_CACHE_VERSION when encode_image's output changes so old renditions aren't served
+    digest = hashlib.sha256(
+        "\0".join([IMAGE_CACHE_VERSION, bucket, key, encoding, str(effort)]).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, f"{digest}.json")
+
+def _read_image_cache(path: str):
+    try:
+        private_dir(IMAGE_CACHE_DIR)
+        with open(path) as f:
+            if not owned_file(f):
+                return None
+            entry = json.load(f)
+        return entry if isinstance(entry, dict) and entry.get("etag") and "result" in entry else None
+    except (OSError, ValueError):
+        return None
+
+def _evict_image_cache():
+    """Removes the least recently served entries until the cache is back under IMAGE_CACHE_MAX_BYTES."""
+    entries = []
+    with os.scandir(IMAGE_CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith(".json"):
+                st = entry.stat(follow_symlinks=False)
+                entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if total <= IMAGE_CACHE_MAX_BYTES:
+        return
+    # Trim to 90% so the next few writes don't each rescan the directory
+    for _, size, path in sorted(entries):
+        if total <= IMAGE_CACHE_MAX_BYTES * 0.9:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def _write_image_cache(path: str, etag: str, result: dict):
+    try:
+        private_dir(IMAGE_CACHE_DIR)
+        fd, tmp_path = tempfile.mkstemp(dir=IMAGE_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"etag": etag, "result": result}, f)
+        os.replace(tmp_path, path)
+        _evict_image_cache()
+    except OSError:
+        pass  # Caching is best-effort
+
+def _is_not_modified(e: ClientError) -> bool:
+    return e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304 or \
+        e.response.get("Error", {}).get("Code") in ("304", "NotModified")
+
+def get_s3_image_data(bucket: str, key: str, profile: str = None, region: str = None,
+                      encoding: str = "png", effort: int = IMAGE_EFFORT):
+    from PIL import Image
     try:
+        if encoding not in IMAGE_ENCODINGS:
+            raise ValueError(f"Unknown image encoding '{encoding}', expected one of {', '.join(IMAGE_ENCODINGS)}")
+        effort = max(0, min(9, effort))
         s3 = get_s3_client(profile, region)
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        raw = obj["Body"].read()
 
-        img_bytes = None
+        # A conditional GET answers 304 when the cached rendition is still current,
+        # so a hit and a miss both cost one round trip
+        cache_path = _image_cache_path(bucket, key, encoding, effort)
+        cached = _read_image_cache(cache_path)
         try:
-            text = raw.decode("utf-8", errors="strict").strip()
-        except UnicodeDecodeError:
-            text = None
-
-        if raw.startswith(b"\x89PNG\r\n\x1a\n"):
-            img_bytes = raw
-        elif text is not None:
-            if text.startswith("data:image/png;base64,"):
-                text = text.split(",", 1)[1].strip()
-            b64 = "".join(text.split())
-            try:
-                img_bytes = base64.b64decode(b64, validate=True)
-            except (base64.binascii.Error, ValueError):
-                img_bytes = base64.b64decode(b64, validate=False)
-        else:
-            try:
-                img_bytes = base64.b64decode(raw, validate=True)
-            except Exception:
-                img_bytes = raw
-        
-        # Verify it's a valid image and convert to PNG if necessary
+            if cached:
+                obj = s3.get_object(Bucket=bucket, Key=key, IfNoneMatch=cached["etag"])
+            else:
+                obj = s3.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if cached and _is_not_modified(e):
+                try:
+                    os.utime(cache_path)  # Mark as recently served for eviction
+                except OSError:
+                    pass
+                return cached["result"]
+            raise
+        raw = obj["Body"].read()
+
+        img_bytes = decode_label_bytes(raw)
+
+        # Verify it's a valid image and re-encode it for transfer
         image = Image.open(io.BytesIO(img_bytes))
-        
-        # Convert to PNG format in base64
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        
-        return {"image_data": f"data:image/png;base64,{img_str}", "width": image.width, "height": image.height}
+        mime_type, encoded, resolved = encode_image(image, encoding, effort)
+        img_str = base64.b64encode(encoded).decode("utf-8")
+
+        result = {"image_data": f"data:{mime_type};base64,{img_str}", "width": image.width, "height": image.height,
+                  "encoding": resolved, "bytes": len(encoded)}
+        if obj.get("ETag"):
+            _write_image_cache(cache_path, obj["ETag"], result)
+        return result
 
     except ConnectionError as e: # Catch our custom connection error
         raise e
@@ -138,6 +286,146 @@ def get_s3_image_data(bucket: str, key: str, profile: str = None, region: str =
     except Exception as e:
         raise ValueError(f"An unexpected error occurred while getting S3 image: {human_error(e)}")
 
+def iter_png_keys(s3, bucket: str, prefix: str, term: str = None):
+    term = (term or "").lower()
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            key = item["Key"]
+            if key.lower().endswith(".png") and term in key.lower():
+                yield key
+
+def export_s3_labels_zip(bucket: str, prefix: str, out, term: str = None, profile: str = None, region: str = None):
+    """
+    Streams every PNG under prefix (optionally filtered by term) into a ZIP
+    written incrementally to out. Objects are fetched concurrently, but only a
+    bounded window of them is held in memory at any time. Keys that can't be
+    fetched or decoded are listed in the archive's manifest.json.
+    """
+    import zipfile
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from itertools import chain
+    try:
+        s3 = get_s3_client(profile, region)
+
+        def fetch(key):
+            try:
+                png = decode_label_bytes(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+                if not png.startswith(PNG_SIGNATURE):
+                    raise ValueError("Decoded payload is not a PNG")
+                return key, png, None
+            except Exception as e:
+                return key, None, human_error(e)
+
+        # List the first page before opening the archive: ZipFile writes its central
+        # directory even when closed by an exception, and once any bytes reach out the
+        # caller can no longer report a missing bucket or denied prefix as an error
+        keys = iter_png_keys(s3, bucket, prefix, term)
+        first = next(keys, None)
+        if first is not None:
+            keys = chain((first,), keys)
+
+        exported = 0
+        failures = []
+        names = set()
+        # PNGs are already deflated, so store them as-is
+        with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as archive, \
+                ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+
+            def write(future):
+                nonlocal exported
+                key, png, error = future.result()
+                if error:
+                    failures.append({"key": key, "error": error})
+                    return
+                name = key[len(prefix):].lstrip("/") or key.split("/")[-1]
+                while name in names:
+                    name = "_" + name
+                names.add(name)
+                archive.writestr(name, png)
+                exported += 1
+
+            pending = deque()
+            for key in keys:
+                pending.append(pool.submit(fetch, key))
+                if len(pending) >= EXPORT_WORKERS * 2:
+                    write(pending.popleft())
+            while pending:
+                write(pending.popleft())
+
+            manifest = {"bucket": bucket, "prefix": prefix, "term": term, "exported": exported, "failures": failures}
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+
+        return {"exported": exported, "failed": len(failures)}
+    except ConnectionError as e: # Catch our custom connection error
+        raise e
+    except (ClientError, BotoCoreError) as e:
+        error_code = e.response.get("Error", {}).get("Code", "Unknown") if hasattr(e, 'response') else "Unknown"
+        error_message = e.response.get("Error", {}).get("Message", human_error(e)) if hasattr(e, 'response') else human_error(e)
+        raise ValueError(f"S3 Export Error [{error_code}]: {error_message}")
+    except Exception as e:
+        raise ValueError(f"An unexpected error occurred while exporting S3 labels: {human_error(e)}")
+
+def read_png_header(head: bytes) -> dict:
+    """
+    Parses the IHDR chunk from the first bytes of a label stored as raw PNG or
+    as base64 text (optionally a data: URL).
+    """
+    if head.startswith(PNG_SIGNATURE):
+        encoding, png = "png", head
+    else:
+        encoding = "base64"
+        text = head.decode("ascii", errors="ignore").lstrip()
+        if text.startswith("data:image/png;base64,"):
+            text = text.split(",", 1)[1]
+        b64 = "".join(text.split())
+        # The range cut may land mid-quantum; only decode whole 4-char groups
+        png = base64.b64decode(b64[:len(b64) // 4 * 4], validate=False)
+        if not png.startswith(PNG_SIGNATURE):
+            raise ValueError("Not a PNG or base64-encoded PNG")
+    if len(png) < 26 or png[12:16] != b"IHDR":
+        raise ValueError("PNG header is truncated or missing IHDR")
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", png[16:26])
+    return {
+        "encoding": encoding,
+        "width": width,
+        "height": height,
+        "bitDepth": bit_depth,
+        "colorType": PNG_COLOR_TYPES.get(color_type, str(color_type)),
+    }
+
+def probe_s3_images(bucket: str, prefix: str, term: str = None, profile: str = None, region: str = None):
+    """
+    Returns one row per PNG under prefix with its dimensions and colour type,
+    read from a ranged GET of each object's first PROBE_BYTES bytes.
+    """
+    try:
+        s3 = get_s3_client(profile, region)
+
+        def probe(key):
+            row = {"key": key}
+            try:
+                obj = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{PROBE_BYTES - 1}")
+                row.update(read_png_header(obj["Body"].read()))
+            except (ClientError, BotoCoreError) as e:
+                error_code = e.response.get("Error", {}).get("Code", "Unknown") if hasattr(e, 'response') else "Unknown"
+                row["error"] = f"S3 Probe Error [{error_code}]: {human_error(e)}"
+            except (ValueError, struct.error) as e:
+                row["error"] = f"Header parse error: {human_error(e)}"
+            return row
+
+        rows = CONTROLLER.map(probe, iter_png_keys(s3, bucket, prefix, term), max_workers=EXPORT_WORKERS)
+        return {"objects": rows}
+    except ConnectionError as e: # Catch our custom connection error
+        raise e
+    except (ClientError, BotoCoreError) as e:
+        error_code = e.response.get("Error", {}).get("Code", "Unknown") if hasattr(e, 'response') else "Unknown"
+        error_message = e.response.get("Error", {}).get("Message", human_error(e)) if hasattr(e, 'response') else human_error(e)
+        raise ValueError(f"S3 Probe Error [{error_code}]: {error_message}")
+    except Exception as e:
+        raise ValueError(f"An unexpected error occurred while probing S3 images: {human_error(e)}")
+
 if __name__ == "__main__":
     command = sys.argv[1]
     
@@ -145,23 +433,57 @@ if __name__ == "__main__":
     region = os.environ.get("AWS_REGION")
 
     try:
+        preload_command(command)
         if command == "list":
             bucket = sys.argv[2]
             prefix = sys.argv[3] if len(sys.argv) > 3 else ""
-            result = list_s3_contents(bucket, prefix, profile, region)
+            from response_cache import cached_response, LIST_TTL
+            result = cached_response("list", (bucket, prefix, profile, region), LIST_TTL,
+                                     lambda: list_s3_contents(bucket, prefix, profile, region))
         elif command == "search":
             bucket = sys.argv[2]
             prefix = sys.argv[3]
             term = sys.argv[4]
-            result = search_s3_newest_first(bucket, prefix, term, profile, region)
+            from response_cache import cached_response, SEARCH_TTL, NEGATIVE_TTL
+            result = cached_response("search", (bucket, prefix, term, profile, region), SEARCH_TTL,
+                                     lambda: search_s3_newest_first(bucket, prefix, term, profile, region),
+                                     negative_ttl=NEGATIVE_TTL)
         elif command == "get_image":
             bucket = sys.argv[2]
             key = sys.argv[3]
-            result = get_s3_image_data(bucket, key, profile, region)
+            encoding = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] else "png"
+            effort = int(sys.argv[5]) if len(sys.argv) > 5 and sys.argv[5] else IMAGE_EFFORT
+            result = get_s3_image_data(bucket, key, profile, region, encoding, effort)
+        elif command == "probe":
+            bucket = sys.argv[2]
+            prefix = sys.argv[3] if len(sys.argv) > 3 else ""
+            term = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] else None
+            result = probe_s3_images(bucket, prefix, term, profile, region)
+        elif command == "export":
+            bucket = sys.argv[2]
+            prefix = sys.argv[3] if len(sys.argv) > 3 else ""
+            term = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] else None
+            output = sys.argv[5] if len(sys.argv) > 5 else "-"
+            if output == "-":
+                # The archive itself is the output; errors can only go to stderr
+                try:
+                    export_s3_labels_zip(bucket, prefix, sys.stdout.buffer, term, profile, region)
+                    sys.stdout.buffer.flush()
+                except Exception as e:
+                    print(json.dumps({"error": human_error(e)}), file=sys.stderr)
+                    sys.exit(1)
+                finally:
+                    CONTROLLER.report()
+                sys.exit(0)
+            with open(output, "wb") as f:
+                result = export_s3_labels_zip(bucket, prefix, f, term, profile, region)
+            result["file"] = output
         else:
             result = {"error": "Invalid command"}
         
         print(json.dumps(result))
+        CONTROLLER.report()
     except Exception as e:
         print(json.dumps({"error": human_error(e)}))
+        CONTROLLER.report()
         sys.exit(1)
@@ -2,6 +2,7 @@ import boto3
 import json
 import os
 import sys
+from s3_controller import CONTROLLER
 
 def get_s3_summary():
     """
@@ -11,20 +12,23 @@ def get_s3_summary():
         # Use the profile passed from the Node.js environment
         aws_profile = os.environ.get('AWS_PROFILE', 'default')
         session = boto3.Session(profile_name=aws_profile)
-        s3 = session.client('s3')
+        s3 = CONTROLLER.client(session)
 
         response = s3.list_buckets()
-        buckets = []
-        for bucket in response['Buckets']:
+
+        def summarize(bucket):
             bucket_name = bucket['Name']
             try:
                 # For each bucket, get the object count
                 obj_count_response = s3.list_objects_v2(Bucket=bucket_name)
                 obj_count = obj_count_response.get('KeyCount', 0)
-                buckets.append({'name': bucket_name, 'objectCount': obj_count})
+                return {'name': bucket_name, 'objectCount': obj_count}
             except Exception as e:
                 # If we can't access a bucket, note it and move on
-                buckets.append({'name': bucket_name, 'objectCount': 'Access Denied', 'error': str(e)})
+                return {'name': bucket_name, 'objectCount': 'Access Denied', 'error': str(e)}
+
+        # Buckets are counted in parallel; the controller keeps each bucket within its own limit
+        buckets = CONTROLLER.map(summarize, response['Buckets'])
 
         return {"buckets": buckets}
 
@@ -35,3 +39,4 @@ if __name__ == "__main__":
     summary = get_s3_summary()
     # Print the JSON summary to stdout for the Node.js process to capture
     print(json.dumps(summary))
+    CONTROLLER.report()